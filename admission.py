@@ -0,0 +1,173 @@
+"""Admission control in front of the /message backend.
+
+Two limits, shared by every session of the server process:
+
+- a token bucket per mobile_no (DONOR_RATE messages a minute, bursts of
+  DONOR_BURST) stops a single donor from flooding the backend; messages over
+  the limit are refused at submit time with the wait until the next token
+- a global cap of MAX_CONCURRENT backend calls; further calls wait in a
+  FIFO queue of at most MAX_WAITING, and the UI shows their position and an
+  estimated wait. A full queue, or a wait longer than MAX_QUEUE_WAIT, fails
+  the call with Overloaded instead of piling more load on the backend.
+
+Calls wait in the gate on dispatcher worker threads, so the dispatcher's
+pool is sized from MAX_CONCURRENT + MAX_WAITING (see dispatcher.py).
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DONOR_RATE = float(os.environ.get("SADHAK_DONOR_RATE") or 10)
+DONOR_BURST = 5
+
+MAX_CONCURRENT = int(os.environ.get("SADHAK_MAX_CONCURRENT") or 16)
+MAX_WAITING = int(os.environ.get("SADHAK_MAX_WAITING") or 16)
+MAX_QUEUE_WAIT = 60.0
+
+# Assumed call duration until real ones have been measured
+DEFAULT_CALL_SECONDS = 5.0
+
+
+class Overloaded(Exception):
+    """Too many calls waiting for the backend"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"backend busy, retry in {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+class DonorLimiter:
+    """Token bucket per mobile number"""
+
+    def __init__(self, per_minute=DONOR_RATE, burst=DONOR_BURST):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self._lock = threading.Lock()
+        # mobile_no -> (tokens, updated)
+        self._buckets = {}
+        self._refused = 0
+
+    def take(self, mobile_no):
+        """0 if the donor may send now (a token is used), else seconds until they may"""
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) > 10000:
+                self._prune(now)
+            tokens, updated = self._buckets.get(mobile_no, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[mobile_no] = (tokens - 1, now)
+                return 0.0
+            self._buckets[mobile_no] = (tokens, now)
+            self._refused += 1
+            return (1 - tokens) / self.rate
+
+    def stats(self):
+        with self._lock:
+            return {"donors": len(self._buckets), "refused": self._refused}
+
+    def _prune(self, now):
+        # A bucket that has refilled is the same as no bucket
+        full = [
+            key for key, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * self.rate >= self.burst
+        ]
+        for key in full:
+            del self._buckets[key]
+
+
+class ConcurrencyGate:
+    """At most limit holders; the rest wait in arrival order in a bounded queue"""
+
+    def __init__(self, limit=MAX_CONCURRENT, max_waiting=MAX_WAITING, max_wait=MAX_QUEUE_WAIT):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = deque()
+        self._call_seconds = None
+        self._rejected = 0
+
+    @contextmanager
+    def slot(self, ticket):
+        """Hold one of the limit slots for the duration of the with block"""
+        self._acquire(ticket)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def position(self, ticket):
+        """(1-based queue position, estimated wait in seconds), or None if not waiting"""
+        with self._cond:
+            try:
+                position = self._waiting.index(ticket) + 1
+            except ValueError:
+                return None
+            return position, self._estimated_wait(position)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "running": self._running,
+                "waiting": len(self._waiting),
+                "rejected": self._rejected,
+                "call_seconds": self._call_seconds,
+            }
+
+    def _acquire(self, ticket):
+        with self._cond:
+            if self._running < self.limit and not self._waiting:
+                self._running += 1
+                return
+            if len(self._waiting) >= self.max_waiting:
+                self._rejected += 1
+                raise Overloaded(self._estimated_wait(len(self._waiting) + 1))
+
+            self._waiting.append(ticket)
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self._waiting[0] != ticket or self._running >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._rejected += 1
+                        raise Overloaded(self._estimated_wait(self._waiting.index(ticket) + 1))
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._waiting.popleft()
+            self._running += 1
+            # The next in line may fit as well
+            self._cond.notify_all()
+
+    def _release(self, seconds):
+        with self._cond:
+            self._running -= 1
+            # Moving average of how long a call holds its slot
+            if self._call_seconds is None:
+                self._call_seconds = seconds
+            else:
+                self._call_seconds = 0.8 * self._call_seconds + 0.2 * seconds
+            self._cond.notify_all()
+
+    def _estimated_wait(self, position):
+        call_seconds = self._call_seconds or DEFAULT_CALL_SECONDS
+        # limit slots free up at an average of one per call_seconds / limit
+        return call_seconds * position / self.limit
+
+
+class AdmissionControl:
+    """Per-donor rate limit plus the global concurrency gate"""
+
+    def __init__(self, donors=None, gate=None):
+        self.donors = donors or DonorLimiter()
+        self.gate = gate or ConcurrencyGate()
+
+    def stats(self):
+        return dict(self.gate.stats(), **{"donors_" + k: v for k, v in self.donors.stats().items()})
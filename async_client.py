@@ -0,0 +1,254 @@
+"""asyncio client for the /message backend.
+
+Same payload and reply contract as BackendClient (build_payload in,
+the /message result dict out, see parse_reply), built on aiohttp so that one
+event loop can drive hundreds of conversations over a shared pool of
+keep-alive connections instead of one thread per call:
+
+- at most max_concurrency calls are in flight, the rest wait on a semaphore
+- every call takes an optional deadline that covers the queue wait too
+- cancelling the awaiting task aborts the request and frees its connection
+
+    async with AsyncBackendClient(max_concurrency=200) as client:
+        async for index, outcome, seconds in client.imap(url, payloads, deadline=60):
+            ...
+
+Synchronous code (Streamlit sessions, the dispatcher's workers, batch
+scripts) shares one client through AsyncClientThread, which runs the event
+loop in a daemon thread.
+"""
+import asyncio
+import threading
+import time
+
+import aiohttp
+
+import wire
+from backend_client import (
+    CONNECT_TIMEOUT, READ_TIMEOUT, STREAM_HEADERS, STREAM_SUFFIX, BackendError, SSEParser, StreamError, token_from,
+)
+
+MAX_CONCURRENCY = 64
+
+
+class AsyncBackendClient:
+    """Keep-alive aiohttp client with a bounded fan-out; use it from a single event loop"""
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 wire_format=None):
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+        self.wire = wire_format or wire.WireFormat()
+        # Created on first use, inside the event loop
+        self._session = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Stream URLs that answered 404/405, so they are not tried again
+        self._no_stream = set()
+        # Only touched from the event loop, so no lock
+        self._requests = 0
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._errors = 0
+        self._timeouts = 0
+        self._cancelled = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def post(self, url, payload, deadline=None):
+        """Send one message and return the /message result
+
+        Raises BackendError on a non-200 answer and asyncio.TimeoutError once
+        deadline seconds (waiting for a slot included) have passed.
+        """
+        return await self._bounded(lambda: self._post(url, payload), deadline)
+
+    async def stream(self, url, payload, on_token=None, deadline=None):
+        """Like post(), calling on_token(token) as the answer streams in"""
+        return await self._bounded(lambda: self._stream(url, payload, on_token), deadline)
+
+    async def imap(self, url, payloads, deadline=None, stream=False):
+        """Send every payload, yielding (index, result or exception, seconds) as calls finish
+
+        At most 2 x max_concurrency calls are scheduled at once, so payloads
+        can be a long or lazy iterable. Calls still running are cancelled if
+        the caller stops iterating.
+        """
+        call = self.stream if stream else self.post
+        pending = {}
+
+        async def finished():
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            now = time.perf_counter()
+            for task in done:
+                index, started = pending.pop(task)
+                outcome = task.exception() or task.result()
+                yield index, outcome, now - started
+
+        try:
+            for index, payload in enumerate(payloads):
+                if len(pending) >= 2 * self.max_concurrency:
+                    async for item in finished():
+                        yield item
+                task = asyncio.ensure_future(call(url, payload, deadline=deadline))
+                pending[task] = (index, time.perf_counter())
+            while pending:
+                async for item in finished():
+                    yield item
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {
+            "requests": self._requests,
+            "errors": self._errors,
+            "timeouts": self._timeouts,
+            "cancelled": self._cancelled,
+            "in_flight": self._in_flight,
+            "peak_in_flight": self._peak_in_flight,
+        }
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    def _client(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=self.timeout,
+            )
+        return self._session
+
+    async def _bounded(self, call, deadline):
+        async def run():
+            async with self._semaphore:
+                self._in_flight += 1
+                self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+                try:
+                    return await call()
+                finally:
+                    self._in_flight -= 1
+
+        try:
+            return await asyncio.wait_for(run(), deadline)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise
+        except asyncio.CancelledError:
+            self._cancelled += 1
+            raise
+        except Exception:
+            self._errors += 1
+            raise
+
+    async def _post(self, url, payload):
+        self._requests += 1
+        body, headers = self.wire.request(url, payload)
+        async with self._client().post(url, data=body, headers=headers) as response:
+            if not self.wire.learn(url, response.status, response.headers):
+                if response.status != 200:
+                    raise BackendError(response.status)
+                return wire.decode(await response.read(), response.headers.get("Content-Type", ""))
+        # The backend doesn't read the compact format after all: plain JSON
+        return await self._post(url, payload)
+
+    async def _stream(self, url, payload, on_token):
+        stream_url = url.rstrip("/") + STREAM_SUFFIX
+        if stream_url not in self._no_stream:
+            self._requests += 1
+            body, headers = self.wire.request(stream_url, payload)
+            headers.update(STREAM_HEADERS)
+            async with self._client().post(stream_url, data=body, headers=headers) as response:
+                refused = self.wire.learn(stream_url, response.status, response.headers)
+                if not refused and response.status not in (404, 405):
+                    return await self._read_stream(response, on_token)
+            if not refused:
+                self._no_stream.add(stream_url)
+
+        result = await self._post(url, payload)
+        if on_token is not None and result.get("ai_response"):
+            on_token(result["ai_response"])
+        return result
+
+    async def _read_stream(self, response, on_token):
+        if response.status != 200:
+            raise BackendError(response.status)
+        if "text/event-stream" not in response.headers.get("Content-Type", ""):
+            # Backend without streaming: the whole answer is one token
+            result = wire.decode(await response.read(), response.headers.get("Content-Type", ""))
+            if on_token is not None and result.get("ai_response"):
+                on_token(result["ai_response"])
+            return result
+
+        tokens = []
+        result = None
+        async for name, data in _events(response):
+            if name == "done":
+                result = wire.loads(data) if data else {}
+                break
+            if name == "error":
+                raise StreamError(data or "stream error")
+            token = token_from(data)
+            if token:
+                tokens.append(token)
+                if on_token is not None:
+                    on_token(token)
+
+        if result is None:
+            # Connection closed without a done event, keep what was received
+            result = {}
+        result.setdefault("ai_response", "".join(tokens))
+        return result
+
+
+async def _events(response):
+    """Parse the SSE stream into (event, data) pairs"""
+    parser = SSEParser()
+    async for line in response.content:
+        event = parser.feed(line.decode("utf-8").rstrip("\r\n"))
+        if event is not None:
+            yield event
+    event = parser.flush()
+    if event is not None:
+        yield event
+
+
+class AsyncClientThread:
+    """An AsyncBackendClient on its own event loop thread, for synchronous callers
+
+    The methods return concurrent.futures.Future objects; cancelling one
+    cancels the call on the loop.
+    """
+
+    def __init__(self, **client_kwargs):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="sadhak-async-client", daemon=True)
+        self._thread.start()
+        self.client = self._run(self._make_client(client_kwargs)).result()
+
+    def post(self, url, payload, deadline=None):
+        return self._run(self.client.post(url, payload, deadline=deadline))
+
+    def stream(self, url, payload, on_token=None, deadline=None):
+        """on_token is called on the loop thread"""
+        return self._run(self.client.stream(url, payload, on_token=on_token, deadline=deadline))
+
+    def stats(self):
+        return self.client.stats()
+
+    def close(self):
+        self._run(self.client.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    @staticmethod
+    async def _make_client(client_kwargs):
+        # Built on the loop that will use it
+        return AsyncBackendClient(**client_kwargs)
@@ -0,0 +1,432 @@
+"""Shared HTTP client for the AI Sadhak /message backend.
+
+One BackendClient is meant to live for the whole Streamlit process (the app
+builds it through st.cache_resource) so every session reuses the same pool of
+keep-alive connections instead of paying DNS + TCP + TLS on every chat turn.
+
+Replies can also be streamed from the SSE variant of the endpoint
+(``<api_url>/stream``). The backend sends ``data: {"token": "..."}`` events
+while the answer is generated and a final ``event: done`` whose data carries
+``ai_reason`` and ``execution_log``.
+
+Every response gets a ``timings`` dict with the client-side phases of the call
+(dns / connect / tls for new connections, then wait and download, see
+timings.py).
+
+Bodies go out in the most compact format the backend is known to read
+(compressed, msgpack), see wire.py; decode() reads an answer in any of them.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+import wire
+
+# SADHAK_* settings can also come from a .env file (the real environment wins).
+# Every module of the app imports this one first, so they all see them.
+load_dotenv()
+
+# Fixed Backend API URL (SADHAK_API_URL overrides it, e.g. for a local backend)
+DEFAULT_API_URL = os.environ.get("SADHAK_API_URL", "https://chatbot-code-scaz.onrender.com/message")
+
+# Connect fails fast, read waits for a slow (or cold) backend
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 90
+
+# Number of hosts to keep pools for, and connections kept per host
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 64
+# Longest a call waits for a free pooled connection before failing
+POOL_TIMEOUT = 30
+
+# Suffix of the SSE endpoint, relative to the /message URL
+STREAM_SUFFIX = "/stream"
+# Uncompressed, so every event can be read as soon as it arrives
+STREAM_HEADERS = {"Accept": "text/event-stream", "Accept-Encoding": "identity"}
+
+
+# Helper function to check if string is a URL
+def is_url(text):
+    """Check if the given text is a URL"""
+    if not text:
+        return False
+    return text.startswith(('http://', 'https://'))
+
+
+def build_payload(user_input, mobile_no, donor_name="", ng_code=0, message_id=None):
+    """The /message request body, exactly as the chat form sends it
+
+    Text starting with http(s):// is sent as an image message.
+    """
+    is_image_url = is_url(user_input)
+    return {
+        "WA_Auto_Id": 0,
+        "WA_In_Out": "In",
+        "Account_Code": 0,
+        "WA_Received_At": datetime.now().isoformat(),
+        "NGCode": ng_code,
+        "Wa_Name": donor_name,
+        "MobileNo": mobile_no,
+        "WA_Msg_To": mobile_no,
+        "WA_Msg_Text": user_input if not is_image_url else "",
+        "WA_Msg_Type": "IMAGE" if is_image_url else "TEXT",
+        "Integration_Type": "streamlit",
+        "WA_Message_Id": message_id or str(uuid.uuid4()),
+        "WA_Url": user_input if is_image_url else "",
+        "Status": "success",
+        "Donor_Name": donor_name
+    }
+
+
+def parse_reply(result):
+    """Answer, classification and execution log of a /message result
+
+    ai_reason carries the classification as "main|sub".
+    """
+    ai_reason = result.get("ai_reason") or ""
+    classification_parts = ai_reason.split("|")
+    return {
+        "ai_response": result.get("ai_response", "Sorry, I couldn't process your request."),
+        "classification": classification_parts[0],
+        "sub_classification": classification_parts[1] if len(classification_parts) > 1 else "",
+        "execution_log": result.get("execution_log", []),
+    }
+
+
+class BackendError(Exception):
+    """The backend answered with a non-200 status"""
+
+    def __init__(self, status_code):
+        super().__init__(f"API Error: {status_code}")
+        self.status_code = status_code
+
+
+class StreamError(Exception):
+    """The backend reported an error in the middle of a stream"""
+
+
+class StreamedReply:
+    """Iterates over reply tokens as they arrive; .result is set once the stream closes
+
+    Also wraps plain JSON replies (backend without a stream endpoint), in which
+    case the whole ai_response comes out as a single token.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.result = None
+        self.timings = dict(getattr(response, "timings", {}))
+        self._tokens = []
+        self._headers_at = time.perf_counter()
+
+    def close(self):
+        self.response.close()
+
+    def __iter__(self):
+        if self.status_code != 200:
+            # Nothing to read: give the connection back to the pool
+            self.response.close()
+            return
+        content_type = self.response.headers.get("Content-Type", "")
+        if "text/event-stream" not in content_type:
+            started = time.perf_counter()
+            self.result = wire.decode(self.response.content, content_type)
+            self.timings["parse"] = time.perf_counter() - started
+            text = self.result.get("ai_response", "")
+            if text:
+                yield text
+            return
+
+        try:
+            for event, data in self._events():
+                if event == "done":
+                    self.result = wire.loads(data) if data else {}
+                    break
+                if event == "error":
+                    raise StreamError(data or "stream error")
+                token = token_from(data)
+                if token:
+                    self._tokens.append(token)
+                    yield token
+        finally:
+            self.response.close()
+            self.timings["download"] = time.perf_counter() - self._headers_at
+
+        if self.result is None:
+            # Connection closed without a done event, keep what was received
+            self.result = {}
+        self.result.setdefault("ai_response", "".join(self._tokens))
+
+    def _events(self):
+        """Parse the SSE stream into (event, data) pairs"""
+        self.response.encoding = "utf-8"
+        parser = SSEParser()
+        for line in self.response.iter_lines(chunk_size=None, decode_unicode=True):
+            event = parser.feed(line)
+            if event is not None:
+                yield event
+        event = parser.flush()
+        if event is not None:
+            yield event
+
+
+class SSEParser:
+    """Line by line SSE parser; feed() returns (event, data) when an event ends"""
+
+    def __init__(self):
+        self.event = "message"
+        self.data = []
+
+    def feed(self, line):
+        if not line:
+            return self.flush()
+        if line.startswith("event:"):
+            self.event = line[6:].strip()
+        elif line.startswith("data:"):
+            value = line[5:]
+            self.data.append(value[1:] if value.startswith(" ") else value)
+        # Anything else (":" comments, id:, retry:) is ignored
+        return None
+
+    def flush(self):
+        event = (self.event, "\n".join(self.data)) if self.data else None
+        self.event = "message"
+        self.data = []
+        return event
+
+
+def token_from(data):
+    """Token events are JSON ({"token": ...}) but plain text is accepted too"""
+    try:
+        value = json.loads(data)
+    except ValueError:
+        return data
+    if isinstance(value, dict):
+        return value.get("token", "")
+    return str(value)
+
+
+class _TimedConnectionMixin:
+    """Records how long DNS, TCP connect and the TLS handshake took"""
+
+    connect_timing = None
+    # True until the first response on this connection has picked up the timing
+    fresh = False
+
+    def _new_conn(self):
+        dns_host = self._dns_host
+        started = time.perf_counter()
+        try:
+            address = socket.getaddrinfo(dns_host, self.port, type=socket.SOCK_STREAM)[0][4][0]
+        except (OSError, IndexError):
+            # Let urllib3 resolve it and raise its usual error
+            address = None
+        resolved = time.perf_counter()
+
+        if address is not None:
+            self._dns_host = address
+        try:
+            sock = super()._new_conn()
+        except OSError:
+            if address is None:
+                raise
+            # First address unreachable: let urllib3 try all of them
+            self._dns_host = dns_host
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = dns_host
+
+        self.connect_timing = {"dns": resolved - started, "connect": time.perf_counter() - resolved}
+        return sock
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        timing = self.connect_timing or {}
+        # Whatever connect() spent beyond the socket setup is the TLS handshake
+        tls = time.perf_counter() - started - sum(timing.values())
+        if isinstance(self, HTTPSConnection):
+            timing["tls"] = max(tls, 0.0)
+        self.connect_timing = timing
+        self.fresh = True
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _PoolTimeoutMixin:
+    """Waits at most POOL_TIMEOUT for a free connection (requests never passes a pool timeout)"""
+
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(timeout=POOL_TIMEOUT if timeout is None else timeout)
+
+
+class _TimedHTTPConnectionPool(_PoolTimeoutMixin, HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(_PoolTimeoutMixin, HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that tags responses with the setup time of new connections"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        try:
+            response = super().send(request, **kwargs)
+        except EmptyPoolError as e:
+            # Every connection is busy (or leaked): fail like an unreachable backend
+            raise requests.exceptions.ConnectionError(e, request=request)
+        # The body is not read yet, so the connection is still attached
+        conn = getattr(response.raw, "connection", None)
+        if conn is not None and getattr(conn, "fresh", False):
+            response.connect_timing = dict(conn.connect_timing or {})
+            conn.fresh = False
+        else:
+            response.connect_timing = {}
+        return response
+
+
+class BackendClient:
+    """Process-wide keep-alive client with pool usage counters"""
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, wire_format=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_maxsize = pool_maxsize
+        self.wire = wire_format or wire.WireFormat()
+
+        # pool_block=True makes callers wait for a free connection instead of
+        # opening throwaway ones once the pool is exhausted
+        self._adapter = TimedHTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+        self.session.headers.update({"Connection": "keep-alive"})
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._requests = 0
+        self._errors = 0
+        # Stream URLs that answered 404/405, so they are not tried again
+        self._no_stream = set()
+
+    def post(self, url, payload, timeout=None, **kwargs):
+        """POST a payload over the shared pool, encoded as the backend reads it"""
+        extra_headers = kwargs.pop("headers", None) or {}
+        body, headers = self.wire.request(url, payload)
+        headers.update(extra_headers)
+        with self._lock:
+            self._requests += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            started = time.perf_counter()
+            response = self.session.post(url, data=body, headers=headers, timeout=timeout or self.timeout, **kwargs)
+            finished = time.perf_counter()
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        if self.wire.learn(url, response.status_code, response.headers):
+            # The backend doesn't read the compact format after all: plain JSON
+            response.close()
+            return self.post(url, payload, timeout, headers=extra_headers, **kwargs)
+
+        timings = dict(getattr(response, "connect_timing", {}))
+        # elapsed runs from sending the request until the headers were parsed
+        headers = response.elapsed.total_seconds()
+        timings["wait"] = max(headers - sum(timings.values()), 0.0)
+        if not kwargs.get("stream"):
+            timings["download"] = max(finished - started - headers, 0.0)
+        response.timings = timings
+        return response
+
+    def stream(self, url, payload, timeout=None):
+        """POST to the SSE variant of url; falls back to url when it has none
+
+        Returns a StreamedReply as soon as the response headers are in.
+        """
+        stream_url = url.rstrip("/") + STREAM_SUFFIX
+        if stream_url not in self._no_stream:
+            response = self.post(
+                stream_url, payload, timeout,
+                stream=True, headers=STREAM_HEADERS,
+            )
+            if response.status_code not in (404, 405):
+                return StreamedReply(response)
+            response.close()
+            self._no_stream.add(stream_url)
+        return StreamedReply(self.post(url, payload, timeout))
+
+    def timeout_within(self, seconds):
+        """(connect, read) timeout of a call that must be done within seconds"""
+        connect, read = self.timeout
+        return connect, min(read, seconds)
+
+    @staticmethod
+    def decode(response):
+        """The /message result of a response, JSON or msgpack"""
+        return wire.decode(response.content, response.headers.get("Content-Type", ""))
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        opened = 0
+        idle = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            if pool.pool is not None:
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "errors": self._errors,
+                "in_flight": self._in_flight,
+                "peak_in_flight": self._peak_in_flight,
+                "connections_opened": opened,
+                "connections_reused": max(self._requests - opened, 0),
+                "idle_connections": idle,
+                "pool_maxsize": self.pool_maxsize,
+            }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,284 @@
+"""Pool of /message backends.
+
+The backend runs as more than one deployment, listed in SADHAK_BACKENDS
+(default: just DEFAULT_API_URL). Every call is routed to one of them:
+
+- a conversation (mobile_no, ng_code) sticks to the backend that took its
+  first message for as long as that backend stays healthy, so follow-ups land
+  where the conversation's context already is
+- new conversations go to a backend drawn at random, weighted by
+  1 / (EWMA latency x (calls in flight + 1)), so a slow or cold instance
+  gets less traffic and wins it back as it speeds up
+- FAILURE_THRESHOLD failed calls in a row take a backend out of rotation; a
+  health checker pings every backend each HEALTH_INTERVAL seconds and puts
+  it back once it answers. A slow ping (a cold start) raises its latency.
+- every attempt of a call is routed on its own (attempt()), so a retry or a
+  hedge goes to a backend the call has not tried yet, when there is one
+
+With SADHAK_SHADOW_URL set, a sample of the calls (SADHAK_SHADOW_SAMPLE) is
+mirrored to that candidate backend in the background. Its answers are
+thrown away; only its latency is compared with the backend that served
+the call.
+
+    SADHAK_BACKENDS=https://a.example/message,https://b.example/message
+    SADHAK_SHADOW_URL=https://candidate.example/message
+    SADHAK_SHADOW_SAMPLE=0.05
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+
+from backend_client import DEFAULT_API_URL, BackendError
+from warmup import COLD_THRESHOLD, PING_TIMEOUT, ping_url_for
+
+BACKEND_URLS = [
+    url.strip() for url in os.environ.get("SADHAK_BACKENDS", "").split(",") if url.strip()
+] or [DEFAULT_API_URL]
+SHADOW_URL = os.environ.get("SADHAK_SHADOW_URL", "")
+SHADOW_SAMPLE = float(os.environ.get("SADHAK_SHADOW_SAMPLE") or 0.05)
+
+# Weight of the newest call in the latency average
+EWMA_ALPHA = 0.3
+# Latency assumed for a backend that has not answered yet
+INITIAL_LATENCY = 1.0
+
+FAILURE_THRESHOLD = 3
+HEALTH_INTERVAL = 30.0
+
+# Conversations remembered for sticky routing
+MAX_STICKY = 10000
+
+# Shadow calls in flight at once; samples beyond that are dropped
+SHADOW_WORKERS = 4
+
+
+def ewma(average, sample, alpha=EWMA_ALPHA):
+    return sample if average is None else alpha * sample + (1 - alpha) * average
+
+
+class Backend:
+    """One deployment and what the pool has seen of it"""
+
+    def __init__(self, url):
+        self.url = url
+        self.ping_url = ping_url_for(url)
+        self.latency = None
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+        self.healthy = True
+        self.last_error = None
+
+    @property
+    def name(self):
+        return urlsplit(self.url).netloc
+
+    def weight(self):
+        return 1.0 / ((self.latency or INITIAL_LATENCY) * (self.in_flight + 1))
+
+
+class BackendPool:
+    """Latency-weighted, health-checked routing of /message calls over several backends"""
+
+    def __init__(self, client, urls=None, shadow_url=SHADOW_URL, shadow_sample=SHADOW_SAMPLE,
+                 health_interval=HEALTH_INTERVAL):
+        self.client = client
+        self.backends = OrderedDict((url, Backend(url)) for url in urls or BACKEND_URLS)
+        self.shadow_url = shadow_url
+        self.shadow_sample = shadow_sample
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        # conversation -> url, least recently used first
+        self._sticky = OrderedDict()
+
+        self._shadow_slots = threading.BoundedSemaphore(SHADOW_WORKERS)
+        self._shadow_pool = ThreadPoolExecutor(max_workers=SHADOW_WORKERS, thread_name_prefix="sadhak-shadow") if shadow_url else None
+        self._shadow = {"calls": 0, "errors": 0, "dropped": 0, "slower": 0, "latency": None, "primary_latency": None}
+
+        # A single backend has nowhere else to send traffic (the warmer pings it anyway)
+        if len(self.backends) > 1:
+            self._thread = threading.Thread(target=self._run, name="sadhak-health", daemon=True)
+            self._thread.start()
+
+    def pick(self, conversation=None, exclude=()):
+        """URL of the backend for the conversation's next call, avoiding exclude if it can"""
+        with self._lock:
+            url = self._sticky.get(conversation) if conversation is not None else None
+            if url is not None and self.backends[url].healthy and url not in exclude:
+                self._sticky.move_to_end(conversation)
+                return url
+
+            backends = list(self.backends.values())
+            # With every backend down, keep trying all of them
+            candidates = [b for b in backends if b.healthy] or backends
+            candidates = [b for b in candidates if b.url not in exclude] or candidates
+            if len(candidates) == 1:
+                url = candidates[0].url
+            else:
+                url = random.choices(candidates, weights=[b.weight() for b in candidates])[0].url
+
+            if conversation is not None:
+                self._sticky[conversation] = url
+                self._sticky.move_to_end(conversation)
+                while len(self._sticky) > MAX_STICKY:
+                    self._sticky.popitem(last=False)
+            return url
+
+    @contextmanager
+    def route(self, payload):
+        """Pick the backend for payload and yield its URL; the with block is the call
+
+        How long the block takes feeds the backend's latency, an exception
+        counts as a failure (except 4xx answers, which are not its fault).
+        """
+        backend = self._begin(self.pick(_conversation(payload)))
+        started = time.monotonic()
+        try:
+            yield backend.url
+        except Exception as e:
+            self._end(backend, error=e)
+            raise
+        seconds = time.monotonic() - started
+        self._end(backend, seconds)
+        self.mirror(payload, seconds)
+
+    def attempt(self, payload, send, tried):
+        """One attempt of a call: send(url) to a backend not in tried, if any is left
+
+        The backend's URL is added to tried, for the attempts after this one.
+        Returns send's response; an exception or a 5xx answer counts as a
+        failure of the backend, the time to the response as its latency.
+        The caller mirrors the call once it has its answer.
+        """
+        backend = self._begin(self.pick(_conversation(payload), exclude=tried))
+        tried.append(backend.url)
+        started = time.monotonic()
+        try:
+            response = send(backend.url)
+        except Exception as e:
+            self._end(backend, error=e)
+            raise
+        error = BackendError(response.status_code) if response.status_code >= 500 else None
+        self._end(backend, time.monotonic() - started, error)
+        return response
+
+    def mirror(self, payload, seconds):
+        """Send a sample of calls to the shadow backend as well"""
+        if self._shadow_pool is None or random.random() >= self.shadow_sample:
+            return
+        if not self._shadow_slots.acquire(blocking=False):
+            with self._lock:
+                self._shadow["dropped"] += 1
+            return
+        self._shadow_pool.submit(self._mirror, payload, seconds)
+
+    def check(self):
+        """Ping every backend now; True if any of them answered"""
+        backends = list(self.backends.values())
+        with ThreadPoolExecutor(max_workers=len(backends)) as pool:
+            return any(list(pool.map(self._ping, backends)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backends": [
+                    {
+                        "url": b.url,
+                        "name": b.name,
+                        "healthy": b.healthy,
+                        "latency": b.latency,
+                        "in_flight": b.in_flight,
+                        "requests": b.requests,
+                        "errors": b.errors,
+                        "last_error": b.last_error,
+                    }
+                    for b in self.backends.values()
+                ],
+                "sticky": len(self._sticky),
+                "shadow": dict(self._shadow, url=self.shadow_url) if self.shadow_url else None,
+            }
+
+    def _begin(self, url):
+        backend = self.backends[url]
+        with self._lock:
+            backend.in_flight += 1
+            backend.requests += 1
+        return backend
+
+    def _end(self, backend, seconds=None, error=None):
+        with self._lock:
+            backend.in_flight -= 1
+            if error is None:
+                backend.failures = 0
+                backend.healthy = True
+                backend.latency = ewma(backend.latency, seconds)
+            elif not (isinstance(error, BackendError) and error.status_code < 500):
+                self._failed(backend, error)
+
+    def _failed(self, backend, error):
+        backend.errors += 1
+        backend.failures += 1
+        backend.last_error = str(error)
+        if backend.failures >= FAILURE_THRESHOLD:
+            backend.healthy = False
+
+    def _ping(self, backend):
+        started = time.monotonic()
+        try:
+            self.client.session.get(backend.ping_url, timeout=PING_TIMEOUT).close()
+        except requests.exceptions.RequestException as e:
+            with self._lock:
+                backend.healthy = False
+                backend.last_error = str(e)
+            return False
+        latency = time.monotonic() - started
+        with self._lock:
+            backend.healthy = True
+            backend.failures = 0
+            if latency > COLD_THRESHOLD:
+                # It was asleep: route around it until real calls show it is fast again
+                backend.latency = max(backend.latency or 0.0, latency)
+        return True
+
+    def _mirror(self, payload, primary_seconds):
+        try:
+            started = time.monotonic()
+            try:
+                # Always the plain endpoint: the whole answer, like the primary call's with block
+                response = self.client.post(self.shadow_url, payload)
+                response.close()
+                if response.status_code != 200:
+                    raise BackendError(response.status_code)
+            except Exception:
+                with self._lock:
+                    self._shadow["errors"] += 1
+                return
+            seconds = time.monotonic() - started
+            with self._lock:
+                self._shadow["calls"] += 1
+                self._shadow["slower"] += seconds > primary_seconds
+                self._shadow["latency"] = ewma(self._shadow["latency"], seconds)
+                self._shadow["primary_latency"] = ewma(self._shadow["primary_latency"], primary_seconds)
+        finally:
+            self._shadow_slots.release()
+
+    def _run(self):
+        while True:
+            time.sleep(self.health_interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"backend pool: health check failed: {e}", file=sys.stderr)
+
+
+def _conversation(payload):
+    return payload["MobileNo"], int(payload["NGCode"] or 0)
@@ -0,0 +1,296 @@
+"""Load test / benchmark for the /message backend.
+
+Replays JSONL files of /message payloads against an endpoint at a controlled
+concurrency and (optionally) arrival rate, then reports throughput, latency
+percentiles, error rates and the client's own CPU and memory use. Results
+are written as JSON so runs can be compared between releases.
+
+With --rate, latency is measured from each request's scheduled arrival, not
+from when a worker picks it up, so time spent queued behind a saturated
+backend shows up in the percentiles. TTFB stays measured from the send.
+
+Each JSONL line is either a full payload, in the shape send_message builds
+(WA_Msg_Text, MobileNo, ...), or a short record that is turned into one:
+
+    {"text": "How do I get my 80G receipt?", "mobile_no": "+919876543210", "ng_code": 0}
+
+Examples:
+
+    python bench.py payloads.jsonl --url http://127.0.0.1:8000/message -c 32 -n 2000
+    python bench.py payloads.jsonl -c 64 --rate 20 --duration 300 -o bench_result.json
+    python bench.py payloads.jsonl -o new.json --compare old.json
+    python bench.py payloads.jsonl --wire json -o plain.json   # without compression / msgpack
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from backend_client import DEFAULT_API_URL, BackendClient, build_payload
+from wire import WireFormat
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def load_payloads(paths):
+    """Read payloads from JSONL files, building them from short records if needed"""
+    payloads = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    sys.exit(f"{path}:{line_no}: not valid JSON")
+                if "WA_Msg_Text" in record or "WA_Url" in record:
+                    payloads.append(record)
+                elif "text" in record:
+                    payloads.append(build_payload(
+                        record["text"],
+                        record.get("mobile_no", "+910000000000"),
+                        record.get("donor_name", ""),
+                        record.get("ng_code", 0),
+                    ))
+                else:
+                    sys.exit(f"{path}:{line_no}: expected a /message payload or a {{\"text\": ...}} record")
+    if not payloads:
+        sys.exit("no payloads to send")
+    return payloads
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(p * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class Recorder:
+    """Collects per-request outcomes from the worker threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.ttfb = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.bytes_received = 0
+
+    def ok(self, status, latency, ttfb, size):
+        with self._lock:
+            self.statuses[status] += 1
+            if status == 200:
+                self.latencies.append(latency)
+                self.ttfb.append(ttfb)
+            else:
+                self.errors[f"HTTP {status}"] += 1
+            self.bytes_received += size
+
+    def failed(self, error):
+        with self._lock:
+            self.errors[type(error).__name__] += 1
+
+
+def send_one(client, url, payload, stream, fresh_ids, recorder, scheduled=None):
+    if fresh_ids:
+        payload = dict(payload, WA_Message_Id=str(uuid.uuid4()), WA_Received_At=datetime.now().isoformat())
+    sent_at = time.perf_counter()
+    started = sent_at if scheduled is None else scheduled
+    try:
+        if stream:
+            reply = client.stream(url, payload)
+            ttfb = time.perf_counter() - sent_at
+            size = sum(len(token.encode("utf-8")) for token in reply)
+        else:
+            response = client.post(url, payload)
+            ttfb = response.elapsed.total_seconds()
+            if response.status_code == 200:
+                client.decode(response)
+            # Bytes as received, before any decompression
+            size = response.raw.tell() or len(response.content)
+        recorder.ok(
+            reply.status_code if stream else response.status_code,
+            time.perf_counter() - started, ttfb, size,
+        )
+    except Exception as e:
+        # Anything left uncaught would vanish into the future, counted nowhere
+        recorder.failed(e)
+
+
+def run(args):
+    payloads = load_payloads(args.payloads)
+    client = BackendClient(read_timeout=args.timeout, pool_maxsize=args.concurrency, wire_format=WireFormat(args.wire))
+    recorder = Recorder()
+
+    if args.requests is None and args.duration is None:
+        args.requests = len(payloads)
+
+    cpu_start = time.process_time()
+    started = time.perf_counter()
+    deadline = started + args.duration if args.duration else None
+    sent = 0
+    # Bounded backlog: in closed-loop mode at most `concurrency` requests are outstanding
+    slots = threading.BoundedSemaphore(args.concurrency if not args.rate else args.concurrency * 4)
+
+    def done(_):
+        slots.release()
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        next_arrival = started
+        while True:
+            if args.requests is not None and sent >= args.requests:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if args.rate:
+                # Open loop: Poisson arrivals at the requested mean rate
+                next_arrival += random.expovariate(args.rate)
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            slots.acquire()
+            payload = payloads[sent % len(payloads)]
+            future = pool.submit(
+                send_one, client, args.url, payload, args.stream, not args.keep_ids, recorder,
+                next_arrival if args.rate else None,
+            )
+            future.add_done_callback(done)
+            sent += 1
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_start
+
+    latencies = sorted(recorder.latencies)
+    ttfb = sorted(recorder.ttfb)
+    completed = len(latencies)
+    failed = sum(recorder.errors.values())
+    summary = {
+        "requests": sent,
+        "completed": completed,
+        "failed": failed,
+        "error_rate": failed / sent if sent else 0.0,
+        "duration_s": wall,
+        "throughput_rps": completed / wall if wall else 0.0,
+        "latency_s": {
+            "mean": sum(latencies) / completed if completed else None,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "ttfb_s": {
+            "p50": percentile(ttfb, 0.50),
+            "p95": percentile(ttfb, 0.95),
+            "p99": percentile(ttfb, 0.99),
+        },
+        "bytes_received": recorder.bytes_received,
+        "bytes_sent": client.wire.stats()["bytes_sent"],
+        "statuses": {str(k): v for k, v in sorted(recorder.statuses.items())},
+        "errors": dict(recorder.errors),
+        "client": {
+            "cpu_s": cpu,
+            "cpu_percent": 100.0 * cpu / wall if wall else 0.0,
+            "max_rss_mb": _max_rss_mb(),
+        },
+        "pool": client.stats(),
+    }
+    meta = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "url": args.url,
+        "payload_files": args.payloads,
+        "payloads": len(payloads),
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "stream": args.stream,
+        "wire": client.wire.stats()["hosts"],
+        "python": platform.python_version(),
+        "host": platform.node(),
+        "release": os.environ.get("SADHAK_RELEASE", ""),
+    }
+    return {"meta": meta, "summary": summary}
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+
+def print_report(result, baseline=None):
+    s = result["summary"]
+    print(f"requests   {s['requests']}  completed {s['completed']}  failed {s['failed']} ({s['error_rate']:.1%})")
+    print(f"throughput {s['throughput_rps']:.2f} req/s over {s['duration_s']:.1f} s")
+    lat = s["latency_s"]
+    print(f"latency    p50 {_ms(lat['p50'])}  p95 {_ms(lat['p95'])}  p99 {_ms(lat['p99'])}  max {_ms(lat['max'])}")
+    print(f"ttfb       p50 {_ms(s['ttfb_s']['p50'])}  p95 {_ms(s['ttfb_s']['p95'])}")
+    print(f"client     cpu {s['client']['cpu_s']:.1f} s ({s['client']['cpu_percent']:.0f}%)  "
+          f"max rss {s['client']['max_rss_mb'] or 0:.0f} MB")
+    if s.get("bytes_sent"):
+        print(f"bytes      sent {s['bytes_sent']}  received {s['bytes_received']}")
+    if s["errors"]:
+        print("errors     " + ", ".join(f"{k}: {v}" for k, v in s["errors"].items()))
+
+    if baseline is not None:
+        b = baseline["summary"]
+        print("\nvs baseline")
+        print(f"throughput {_delta(b['throughput_rps'], s['throughput_rps'])}")
+        for key in ("p50", "p95", "p99"):
+            print(f"latency {key} {_delta(b['latency_s'][key], lat[key])}")
+        print(f"error rate {b['error_rate']:.1%} -> {s['error_rate']:.1%}")
+
+
+def _delta(old, new):
+    if not old or new is None:
+        return f"{old} -> {new}"
+    return f"{old:.4g} -> {new:.4g} ({(new - old) / old:+.1%})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /message backend with JSONL payloads")
+    parser.add_argument("payloads", nargs="+", help="JSONL files of /message payloads")
+    parser.add_argument("--url", default=DEFAULT_API_URL, help="endpoint to call (default: %(default)s)")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="parallel requests (default: 8)")
+    parser.add_argument("--rate", type=float, help="open-loop arrival rate in requests/s (default: closed loop)")
+    parser.add_argument("-n", "--requests", type=int, help="total requests, cycling through the payloads")
+    parser.add_argument("--duration", type=float, help="stop sending after this many seconds")
+    parser.add_argument("--stream", action="store_true", help="use the SSE endpoint")
+    parser.add_argument("--timeout", type=float, default=90, help="read timeout in seconds (default: 90)")
+    parser.add_argument("--keep-ids", action="store_true", help="send WA_Message_Id as given instead of fresh ones")
+    parser.add_argument("--wire", choices=("auto", "json"), default="auto",
+                        help="auto: compression and msgpack when the backend supports them; json: plain JSON")
+    parser.add_argument("-o", "--output", help="write the result JSON here")
+    parser.add_argument("--compare", help="earlier result JSON to compare against")
+    args = parser.parse_args()
+
+    result = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nresult written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Send a file of donor messages through the /message backend without the UI.
+
+For classification regression tests and campaign dry-runs. Reads CSV or
+JSONL records, builds each payload exactly as the chat form does, sends
+them with bounded concurrency and writes one JSONL result per message, in
+completion order, as soon as it is known. Does not import Streamlit.
+
+Records need a text column; mobile_no, donor_name, ng_code, id and
+expected (the expected "main|sub" or main classification) are optional:
+
+    text,mobile_no,ng_code,expected
+    How do I get my 80G receipt?,+919876543210,0,Donation|80G Certificate
+
+Examples:
+
+    python bulk_send.py donors.csv -c 16 -o results.jsonl
+    python bulk_send.py messages.jsonl --url http://127.0.0.1:8000/message --mobile +910000000000
+    python bulk_send.py donors.csv --dry-run -o payloads.jsonl
+    python bulk_send.py campaign.jsonl --async -c 200 --deadline 120 -o results.jsonl
+
+--async sends from a single event loop (async_client.py, needs aiohttp), which
+scales to hundreds of concurrent messages without a thread for each.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend_client import DEFAULT_API_URL, BackendClient, BackendError, build_payload, parse_reply
+from resilience import ResiliencePolicy
+
+
+def read_records(path, fmt=None):
+    """Yield (line number, record) from a CSV or JSONL file ("-" reads stdin)"""
+    if fmt is None:
+        fmt = "csv" if path.lower().endswith(".csv") else "jsonl"
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+    try:
+        if fmt == "csv":
+            # Line 1 is the header
+            for line_no, row in enumerate(csv.DictReader(f), 2):
+                yield line_no, row
+        else:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError:
+                    yield line_no, {"_error": "not valid JSON"}
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def payload_for(record, default_mobile, default_ng_code):
+    text = str(record.get("text") or record.get("message") or "").strip()
+    if not text:
+        raise ValueError(record.get("_error", "no text"))
+    return build_payload(
+        text,
+        str(record.get("mobile_no") or default_mobile or "").strip(),
+        str(record.get("donor_name") or "").strip(),
+        int(record.get("ng_code") or default_ng_code),
+    )
+
+
+def matches(expected, reply):
+    """expected is either "main" or "main|sub" """
+    if "|" in expected:
+        return expected == f"{reply['classification']}|{reply['sub_classification']}"
+    return expected == reply["classification"]
+
+
+def result_line(line_no, record, payload, outcome, seconds, with_log):
+    """Output record for one message; outcome is the /message result or the exception"""
+    out = {"line": line_no}
+    if record.get("id"):
+        out["id"] = record["id"]
+    out["text"] = payload["WA_Msg_Text"] or payload["WA_Url"]
+    out["message_id"] = payload["WA_Message_Id"]
+    if isinstance(outcome, BackendError):
+        out["error"] = f"HTTP {outcome.status_code}"
+    elif isinstance(outcome, BaseException):
+        out["error"] = f"{type(outcome).__name__}: {outcome}"
+    else:
+        reply = parse_reply(outcome)
+        out["ai_response"] = reply["ai_response"]
+        out["classification"] = reply["classification"]
+        out["sub_classification"] = reply["sub_classification"]
+        if with_log:
+            out["execution_log"] = reply["execution_log"]
+    out["latency_s"] = round(seconds, 4)
+    if record.get("expected") and "classification" in out:
+        out["expected"] = record["expected"]
+        out["match"] = matches(record["expected"], out)
+    return out
+
+
+def send(client, policy, url, line_no, record, payload, with_log):
+    started = time.perf_counter()
+    try:
+        response = policy.call(lambda seconds: client.post(url, payload, client.timeout_within(seconds)))
+        if response.status_code != 200:
+            raise BackendError(response.status_code)
+        outcome = client.decode(response)
+    except Exception as e:
+        outcome = e
+    return result_line(line_no, record, payload, outcome, time.perf_counter() - started, with_log)
+
+
+class ResultWriter:
+    """Writes results from the worker threads, one JSON line each, and counts them"""
+
+    def __init__(self, f):
+        self.f = f
+        self._lock = threading.Lock()
+        self.ok = 0
+        self.failed = 0
+        self.checked = 0
+        self.matched = 0
+
+    def write(self, result):
+        with self._lock:
+            if "error" in result:
+                self.failed += 1
+            else:
+                self.ok += 1
+            if "match" in result:
+                self.checked += 1
+                self.matched += result["match"]
+            self.f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            self.f.flush()
+
+
+def messages(args, writer):
+    """(line number, record, payload) of every sendable record; the others are written out directly"""
+    for line_no, record in read_records(args.input, args.format):
+        try:
+            payload = payload_for(record, args.mobile, args.ng_code)
+        except ValueError as e:
+            writer.write({"line": line_no, "error": f"bad record: {e}"})
+            continue
+        if args.dry_run:
+            writer.write({"line": line_no, "payload": payload})
+            continue
+        yield line_no, record, payload
+
+
+def send_threaded(args, writer):
+    client = BackendClient(read_timeout=args.timeout, pool_maxsize=args.concurrency)
+    # If the backend dies, the circuit breaker fails the rest of the file fast
+    policy = ResiliencePolicy(retries=args.retries, hedge=False)
+    # At most 2x concurrency records are read ahead of the senders
+    slots = threading.BoundedSemaphore(args.concurrency * 2)
+
+    def done(future):
+        slots.release()
+        writer.write(future.result())
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for line_no, record, payload in messages(args, writer):
+                slots.acquire()
+                future = pool.submit(send, client, policy, args.url, line_no, record, payload, args.with_log)
+                future.add_done_callback(done)
+    finally:
+        client.close()
+        policy.shutdown()
+
+
+async def send_async(args, writer):
+    # aiohttp is only needed for --async
+    from async_client import AsyncBackendClient
+
+    sent = {}
+
+    def payloads():
+        for index, (line_no, record, payload) in enumerate(messages(args, writer)):
+            sent[index] = (line_no, record, payload)
+            yield payload
+
+    async with AsyncBackendClient(max_concurrency=args.concurrency, read_timeout=args.timeout) as client:
+        async for index, outcome, seconds in client.imap(args.url, payloads(), deadline=args.deadline):
+            line_no, record, payload = sent.pop(index)
+            writer.write(result_line(line_no, record, payload, outcome, seconds, args.with_log))
+
+
+def run(args, out):
+    writer = ResultWriter(out)
+    started = time.perf_counter()
+    if args.use_async:
+        asyncio.run(send_async(args, writer))
+    else:
+        send_threaded(args, writer)
+
+    elapsed = time.perf_counter() - started
+    summary = f"{writer.ok} ok, {writer.failed} failed in {elapsed:.1f} s"
+    if writer.checked:
+        summary += f"; classification {writer.matched}/{writer.checked} as expected"
+    print(summary, file=sys.stderr)
+    return writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a CSV/JSONL file of messages through the /message backend")
+    parser.add_argument("input", help="CSV or JSONL file of messages, - for JSONL on stdin")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format (default: by file extension)")
+    parser.add_argument("--url", default=DEFAULT_API_URL, help="endpoint to call (default: %(default)s)")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="parallel requests (default: 8)")
+    parser.add_argument("--mobile", help="mobile number for records without one")
+    parser.add_argument("--ng-code", type=int, default=0, help="NG code for records without one")
+    parser.add_argument("--timeout", type=float, default=90, help="read timeout in seconds (default: 90)")
+    parser.add_argument("--retries", type=int, default=2, help="retries of failed calls, threaded mode only (default: 2)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="send from one asyncio event loop instead of a thread per call")
+    parser.add_argument("--deadline", type=float, help="with --async: give up on a message after this many seconds")
+    parser.add_argument("--with-log", action="store_true", help="include the backend execution log")
+    parser.add_argument("--dry-run", action="store_true", help="write the payloads instead of sending them")
+    parser.add_argument("-o", "--output", help="write results here instead of stdout")
+    args = parser.parse_args()
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        writer = run(args, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    sys.exit(1 if writer.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Coalescing of duplicate outgoing messages.
+
+A double click, a rerun race or a second browser tab can submit the same
+text for the same mobile number twice in a row. Both submits get the same
+key (mobile_no, normalized text), so:
+
+- while the first call is still in flight, the second does not reach the
+  backend; it waits for the first one and gets its result (Coalescer).
+  Once the first call has answered, the same text is a new message.
+- Each new message gets a random WA_Message_Id. A resubmit of the message
+  that is still pending (in flight or in the outbox) reuses its id, so if
+  both do reach the server it can treat them as one message. Retries of one
+  call always resend the same payload, and so the same id.
+"""
+import os
+import threading
+from concurrent.futures import Future
+
+from response_cache import normalize
+
+DEDUPE_WINDOW = float(os.environ.get("SADHAK_DEDUPE_WINDOW") or 10)
+
+
+def message_key(mobile_no, text):
+    """Dedupe key of a message; image URLs are compared as sent"""
+    return (mobile_no, text if text.startswith(("http://", "https://")) else normalize(text))
+
+
+class Coalescer:
+    """Runs one call per key at a time; duplicates wait for it and share its result"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> Future of the call in flight
+        self._calls = {}
+        self._calls_made = 0
+        self._coalesced = 0
+
+    def run(self, key, fn):
+        """(fn's result, True) or, for a duplicate, (the first call's result, False)
+
+        Only calls still in flight are shared: the key is forgotten as soon
+        as the call returns or fails, so the next submit is sent. Duplicates
+        already waiting on a failed call get its error too.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            duplicate = future is not None
+            if duplicate:
+                self._coalesced += 1
+            else:
+                self._calls_made += 1
+                future = self._calls[key] = Future()
+
+        if duplicate:
+            return future.result(), False
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._forget(key, future)
+            future.set_exception(e)
+            raise
+        self._forget(key, future)
+        future.set_result(result)
+        return result, True
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self._calls_made, "coalesced": self._coalesced, "tracked": len(self._calls)}
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
@@ -0,0 +1,179 @@
+"""Background dispatch of outgoing chat messages.
+
+Each browser session gets its own FIFO outbound queue; all queues are served
+by one shared worker pool, so a slow backend call never blocks the session's
+script thread. The app submits a job, returns immediately, and a polling
+fragment collects finished jobs and appends their replies to the history.
+
+Jobs of one session run one at a time, in submit order, so replies come back
+in the order the messages were sent.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import MAX_CONCURRENT, MAX_WAITING
+
+# Jobs queue for the backend in the admission gate, which holds its workers:
+# there must be a worker for every call it runs or queues, plus spare ones so
+# the overflow reaches the gate and is refused with Overloaded instead of
+# waiting unseen in the pool's own queue. The spares also serve jobs that
+# never call the backend (cached answers, rejected images).
+SPARE_WORKERS = 16
+MAX_WORKERS = MAX_CONCURRENT + MAX_WAITING + SPARE_WORKERS
+
+# Sessions with no activity for this long are dropped (closed browser tabs)
+SESSION_IDLE_SECONDS = 3600
+
+# A session that polled this recently still has its tab open
+SESSION_LIVE_SECONDS = 60
+
+
+class Job:
+    """One outgoing message and, once done, its reply"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, session_id, fn, args):
+        self.id = next(self._ids)
+        self.session_id = session_id
+        self.fn = fn
+        self.args = args
+        self.status = "queued"
+        self.partial = ""
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def append_partial(self, text):
+        """Called by fn while a streamed reply is still arriving"""
+        self.partial += text
+
+
+class _SessionQueue:
+    def __init__(self):
+        self.jobs = deque()
+        self.finished = []
+        self.running = None
+        self.busy = False
+        self.last_seen = time.time()
+
+
+class Dispatcher:
+    """Shared worker pool serving per-session outbound queues"""
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sadhak-dispatch")
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def submit(self, session_id, fn, *args):
+        """Queue fn(job, *args) for the session; its return value becomes job.result"""
+        job = Job(session_id, fn, args)
+        with self._lock:
+            self._prune()
+            queue = self._sessions.setdefault(session_id, _SessionQueue())
+            queue.jobs.append(job)
+            queue.last_seen = time.time()
+            if not queue.busy:
+                queue.busy = True
+                self._executor.submit(self._drain, queue)
+        return job
+
+    def pending(self, session_id):
+        """Jobs of the session that are queued or running, oldest first"""
+        with self._lock:
+            queue = self._sessions.get(session_id)
+            if queue is None:
+                return []
+            queue.last_seen = time.time()
+            running = [queue.running] if queue.running is not None else []
+            return running + list(queue.jobs)
+
+    def collect(self, session_id):
+        """Take the finished jobs of the session, oldest first"""
+        with self._lock:
+            queue = self._sessions.get(session_id)
+            if queue is None:
+                return []
+            queue.last_seen = time.time()
+            finished, queue.finished = queue.finished, []
+            return finished
+
+    def deliver(self, session_id, result, max_idle=SESSION_LIVE_SECONDS):
+        """Hand a result produced elsewhere (the outbox) to the session as a finished job
+
+        Returns False if the session has not been seen for max_idle seconds.
+        """
+        with self._lock:
+            queue = self._sessions.get(session_id)
+            if queue is None or time.time() - queue.last_seen > max_idle:
+                return False
+            job = Job(session_id, None, ())
+            job.result = result
+            job.status = "done"
+            job.finished_at = time.time()
+            queue.finished.append(job)
+            return True
+
+    def discard(self, session_id):
+        """Drop everything queued or finished for the session (Clear Chat)"""
+        with self._lock:
+            queue = self._sessions.get(session_id)
+            if queue is None:
+                return
+            for job in queue.jobs:
+                job.status = "cancelled"
+            queue.jobs.clear()
+            queue.finished = []
+            if queue.running is not None:
+                # Let it finish, but its reply is not delivered
+                queue.running.status = "cancelled"
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "queued": sum(len(q.jobs) for q in self._sessions.values()),
+                "running": sum(1 for q in self._sessions.values() if q.running is not None),
+            }
+
+    def _drain(self, queue):
+        while True:
+            with self._lock:
+                if not queue.jobs:
+                    queue.busy = False
+                    queue.running = None
+                    return
+                job = queue.jobs.popleft()
+                queue.running = job
+                job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = job.fn(job, *job.args)
+                status = "done"
+            except Exception as e:
+                job.error = e
+                status = "failed"
+            job.finished_at = time.time()
+            with self._lock:
+                if job.status != "cancelled":
+                    job.status = status
+                    queue.finished.append(job)
+                queue.running = None
+
+    def _prune(self):
+        cutoff = time.time() - SESSION_IDLE_SECONDS
+        for session_id in [s for s, q in self._sessions.items() if q.last_seen < cutoff and not q.busy]:
+            del self._sessions[session_id]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,229 @@
+"""SQLite-backed conversation history, keyed by mobile number and NG code.
+
+Optional: the app only uses it when SADHAK_HISTORY_DB points at a database
+file. The database runs in WAL mode so the writer never blocks readers;
+messages are queued and written in batches by a background thread, and reads
+are paginated through the (mobile_no, ng_code, id) index, keyed on the
+message a page ends before rather than on counts, so rows that another tab,
+process or the outbox adds to a conversation don't shift the pages.
+
+Bulk export:
+
+    python history_db.py chat_history.db export.jsonl [--mobile +91...] [--ng-code 123]
+"""
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+
+from message_store import ChatMessage
+
+DB_PATH = os.environ.get("SADHAK_HISTORY_DB", "")
+
+# Writes are flushed when this many are queued, or after FLUSH_INTERVAL seconds
+BATCH_SIZE = 50
+FLUSH_INTERVAL = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT NOT NULL DEFAULT '',
+    mobile_no TEXT NOT NULL,
+    ng_code INTEGER NOT NULL DEFAULT 0,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    ts REAL NOT NULL,
+    image_url TEXT NOT NULL DEFAULT '',
+    classification TEXT NOT NULL DEFAULT '',
+    sub_classification TEXT NOT NULL DEFAULT '',
+    confidence TEXT NOT NULL DEFAULT '',
+    execution_log TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (mobile_no, ng_code, id);
+"""
+
+COLUMNS = "message_id, role, content, ts, image_url, classification, sub_classification, confidence, execution_log"
+
+# Rows written before message_id existed get one derived from their row id
+SELECT_COLUMNS = "COALESCE(NULLIF(message_id, ''), 'row-' || id), " + COLUMNS.split(", ", 1)[1]
+
+
+class HistoryDB:
+    """Persistent conversation history with batched writes"""
+
+    def __init__(self, path=DB_PATH, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._write_lock = threading.Lock()
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(messages)")]
+        if "message_id" not in columns:
+            conn.execute("ALTER TABLE messages ADD COLUMN message_id TEXT NOT NULL DEFAULT ''")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_message_id ON messages (message_id)")
+        conn.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name="sadhak-history-writer", daemon=True)
+        self._writer.start()
+
+    def _conn(self):
+        """One connection per thread (sqlite3 connections are not shareable)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # Writes
+
+    def add(self, key, message):
+        """Queue a message for the conversation key = (mobile_no, ng_code)"""
+        self._queue.put((key, message))
+
+    def flush(self):
+        """Wait until everything queued so far is written"""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def delete(self, key):
+        self.flush()
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("DELETE FROM messages WHERE mobile_no = ? AND ng_code = ?", key)
+            conn.commit()
+
+    def _write_loop(self):
+        # Single writer, so rows land in the order they were queued
+        while True:
+            batch = []
+            waiters = []
+            item = self._queue.get()
+            try:
+                while True:
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                pass
+            try:
+                self._write(batch)
+            except sqlite3.Error as e:
+                print(f"history_db: write failed: {e}", file=sys.stderr)
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, batch):
+        if not batch:
+            return
+        rows = [
+            (
+                mobile_no, ng_code, m.id, m.role, m.content, m.ts, m.image_url,
+                m.classification, m.sub_classification, m.confidence,
+                json.dumps([list(entry) for entry in m.execution_log], ensure_ascii=False),
+            )
+            for (mobile_no, ng_code), m in batch
+        ]
+        with self._write_lock:
+            conn = self._conn()
+            conn.executemany(
+                f"INSERT INTO messages (mobile_no, ng_code, {COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+
+    # Reads
+
+    def count(self, key):
+        """Messages per role for the conversation"""
+        rows = self._conn().execute(
+            "SELECT role, COUNT(*) FROM messages WHERE mobile_no = ? AND ng_code = ? GROUP BY role", key
+        ).fetchall()
+        return dict(rows)
+
+    def before(self, key, message_id=None, limit=20, skip=0):
+        """Up to limit messages of a conversation, oldest first, older than message_id
+
+        Without message_id, the newest ones. skip leaves out that many right
+        before it, for pages further back.
+        """
+        if limit <= 0:
+            return []
+        query = f"SELECT {SELECT_COLUMNS} FROM messages WHERE mobile_no = ? AND ng_code = ?"
+        params = list(key)
+        if message_id is not None:
+            query += " AND id < ?"
+            params.append(self._row_id(message_id))
+        query += " ORDER BY id DESC LIMIT ? OFFSET ?"
+        rows = self._conn().execute(query, (*params, limit, skip)).fetchall()
+        return [_message(row) for row in reversed(rows)]
+
+    def _row_id(self, message_id):
+        if message_id.startswith("row-"):
+            return int(message_id[4:])
+        row = self._conn().execute("SELECT id FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+        # Not written yet: every stored message is older
+        return row[0] if row else sys.maxsize
+
+    def export(self, f, key=None):
+        """Write conversations (all, or just key) to f as JSONL; returns the row count"""
+        self.flush()
+        query = f"SELECT mobile_no, ng_code, {SELECT_COLUMNS} FROM messages"
+        params = ()
+        if key is not None:
+            query += " WHERE mobile_no = ? AND ng_code = ?"
+            params = key
+        query += " ORDER BY mobile_no, ng_code, id"
+
+        count = 0
+        for row in self._conn().execute(query, params):
+            record = _message(row[2:]).to_dict()
+            del record["id"]
+            record["mobile_no"], record["ng_code"] = row[0], row[1]
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+        return count
+
+
+def _message(row):
+    message_id, role, content, ts, image_url, classification, sub_classification, confidence, execution_log = row
+    return ChatMessage(
+        role, content, ts=ts, image_url=image_url,
+        classification=classification, sub_classification=sub_classification,
+        confidence=confidence, execution_log=json.loads(execution_log), id=message_id,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export chat history to JSONL")
+    parser.add_argument("db", help="SQLite history database")
+    parser.add_argument("output", help="JSONL file to write ('-' for stdout)")
+    parser.add_argument("--mobile", help="Only this mobile number")
+    parser.add_argument("--ng-code", type=int, default=0, help="NG code of --mobile (default 0)")
+    args = parser.parse_args()
+
+    db = HistoryDB(args.db)
+    key = (args.mobile, args.ng_code) if args.mobile else None
+    if args.output == "-":
+        count = db.export(sys.stdout, key)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            count = db.export(f, key)
+    print(f"Exported {count} messages", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
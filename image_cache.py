@@ -0,0 +1,330 @@
+"""Thumbnail pipeline for image messages.
+
+A remote image is fetched once, downscaled to the width it is shown at,
+re-encoded as a compact JPEG and kept in a content-addressed cache: blobs are
+named by the SHA-256 of the thumbnail bytes, and a small ref file maps each
+URL to its blob. Recently used thumbnails stay in memory; the disk cache is
+trimmed (least recently used first) when it grows past its size limit.
+
+Image URLs are typed by donors and fetched by the server, so fetch() only
+follows links whose host resolves to a public address, checking every
+redirect the same way: loopback, the private network and the cloud
+metadata service (169.254.169.254) are never reached. Sessions made by
+public_session() also connect to exactly the address that was checked, so
+a host can't pass the check and then resolve somewhere private (DNS
+rebinding), and they ignore proxy settings, which would resolve it again.
+"""
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from PIL import Image, ImageOps
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+THUMBNAIL_WIDTH = 200
+JPEG_QUALITY = 80
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "sadhak_thumbs")
+MEMORY_BYTES = 16 * 1024 * 1024
+DISK_BYTES = 256 * 1024 * 1024
+
+# Images larger than this are not downloaded at all
+MAX_DOWNLOAD_BYTES = 15 * 1024 * 1024
+FETCH_TIMEOUT = (5, 15)
+
+FETCH_MAX_REDIRECTS = 5
+
+# Larger images are refused: decoding them would take too much memory
+MAX_PIXELS = 40_000_000
+
+# Failed URLs are not retried on every rerun
+FAILURE_TTL = 60
+
+
+class BlockedURL(ValueError):
+    """A URL the server must not fetch"""
+
+
+def parse_size(value):
+    """A byte count from a response header; None if it is missing or malformed"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return None
+    return size if size >= 0 else None
+
+
+def check_url(url):
+    """Raise BlockedURL unless url is http(s) and its host resolves only to public addresses"""
+    parts = urlsplit(url)
+    try:
+        port = parts.port
+    except ValueError:
+        raise BlockedURL("the link has an invalid port")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise BlockedURL("the link is not an http(s) address")
+    public_address(parts.hostname, port or parts.scheme)
+
+
+def public_address(host, port):
+    """An address of host to connect to; BlockedURL if any of its addresses isn't public"""
+    try:
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise BlockedURL("the link's host could not be found")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        # ::ffff:127.0.0.1 is loopback too
+        address = getattr(address, "ipv4_mapped", None) or address
+        if not address.is_global:
+            raise BlockedURL("the link points to a private address")
+    return infos[0][4][0]
+
+
+def fetch(session, method, url, **kwargs):
+    """session.request(method, url), refusing blocked URLs and redirects to them"""
+    for _ in range(FETCH_MAX_REDIRECTS + 1):
+        check_url(url)
+        response = session.request(method, url, allow_redirects=False, **kwargs)
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(url, response.headers["Location"])
+    raise requests.exceptions.TooManyRedirects(f"more than {FETCH_MAX_REDIRECTS} redirects", response=response)
+
+
+class _PublicConnectionMixin:
+    """Connects to the address public_address() vetted; Host and SNI keep the name"""
+
+    def _new_conn(self):
+        dns_host = self._dns_host
+        self._dns_host = public_address(dns_host, self.port)
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = dns_host
+
+
+class _PublicHTTPConnection(_PublicConnectionMixin, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class PublicHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that only ever connects to public addresses"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _PublicHTTPConnectionPool,
+            "https": _PublicHTTPSConnectionPool,
+        }
+
+
+def public_session(**adapter_kwargs):
+    """Session for fetching donor-supplied URLs"""
+    session = requests.Session()
+    session.trust_env = False
+    adapter = PublicHTTPAdapter(**adapter_kwargs)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ThumbnailCache:
+    """LRU memory + disk cache of downscaled images, keyed by URL"""
+
+    def __init__(self, cache_dir=CACHE_DIR, memory_bytes=MEMORY_BYTES, disk_bytes=DISK_BYTES,
+                 width=THUMBNAIL_WIDTH):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.width = width
+        self.session = public_session()
+
+        self._lock = threading.Lock()
+        self._refs = OrderedDict()
+        self._blobs = OrderedDict()
+        self._memory_used = 0
+        self._failed = {}
+
+        os.makedirs(os.path.join(cache_dir, "refs"), exist_ok=True)
+        self._disk_used = sum(
+            entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file()
+        )
+
+    def get(self, url):
+        """Thumbnail bytes for url, fetching it on first use; None if it can't be loaded"""
+        data = self.cached(url)
+        if data is not None:
+            return data
+
+        failed_at = self._failed.get(url)
+        if failed_at is not None and time.time() - failed_at < FAILURE_TTL:
+            return None
+        try:
+            return self.put(url, self._fetch(url))
+        except (requests.exceptions.RequestException, OSError, ValueError, Image.DecompressionBombError):
+            self._failed[url] = time.time()
+            return None
+
+    def cached(self, url):
+        """Thumbnail bytes if url is already in the memory or disk cache"""
+        with self._lock:
+            digest = self._refs.get(url)
+            if digest is not None:
+                self._refs.move_to_end(url)
+                data = self._blobs.get(digest)
+                if data is not None:
+                    self._blobs.move_to_end(digest)
+                    return data
+
+        if digest is None:
+            digest = self._read_ref(url)
+            if digest is None:
+                return None
+        try:
+            blob_path = self._blob_path(digest)
+            with open(blob_path, "rb") as f:
+                data = f.read()
+            # mtime doubles as the LRU clock of the disk cache
+            os.utime(blob_path)
+        except OSError:
+            return None
+        self._remember(url, digest, data)
+        return data
+
+    def put(self, url, raw):
+        """Downscale raw image bytes and cache the thumbnail for url"""
+        data = self.thumbnail(raw)
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            self._write_file(blob_path, data)
+        self._write_file(self._ref_path(url), digest.encode("ascii"))
+        self._remember(url, digest, data)
+        self._trim_disk()
+        return data
+
+    def thumbnail(self, raw):
+        """Re-encode raw image bytes as a JPEG at most self.width pixels wide"""
+        with Image.open(io.BytesIO(raw)) as image:
+            # Only the header has been read so far: refuse before decoding anything
+            if image.width * image.height > MAX_PIXELS:
+                raise ValueError("image too large")
+            # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale; keep both sides at
+            # least self.width, whichever way EXIF turns the image
+            image.draft("RGB", (self.width, self.width))
+            image = ImageOps.exif_transpose(image)
+            if image.width > self.width:
+                height = max(1, round(image.height * self.width / image.width))
+                # reduce() by whole factors first, then LANCZOS on the smaller image
+                image = image.resize((self.width, height), Image.LANCZOS, reducing_gap=3.0)
+            if image.mode != "RGB":
+                # JPEG has no alpha: flatten transparent images onto white
+                background = Image.new("RGB", image.size, "white")
+                rgba = image.convert("RGBA")
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                image = background
+            out = io.BytesIO()
+            image.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+            return out.getvalue()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_bytes": self._memory_used,
+                "memory_items": len(self._blobs),
+                "disk_bytes": self._disk_used,
+            }
+
+    def _fetch(self, url):
+        with fetch(self.session, "GET", url, timeout=FETCH_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            if (parse_size(response.headers.get("Content-Length")) or 0) > MAX_DOWNLOAD_BYTES:
+                raise ValueError("image too large")
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > MAX_DOWNLOAD_BYTES:
+                    raise ValueError("image too large")
+                chunks.append(chunk)
+            return b"".join(chunks)
+
+    def _remember(self, url, digest, data):
+        with self._lock:
+            self._refs[url] = digest
+            self._refs.move_to_end(url)
+            if digest not in self._blobs:
+                self._blobs[digest] = data
+                self._memory_used += len(data)
+            self._blobs.move_to_end(digest)
+            while self._memory_used > self.memory_bytes and len(self._blobs) > 1:
+                _, evicted = self._blobs.popitem(last=False)
+                self._memory_used -= len(evicted)
+            # Refs are tiny, but keep the table bounded too
+            while len(self._refs) > 10 * max(len(self._blobs), 100):
+                self._refs.popitem(last=False)
+
+    def _trim_disk(self):
+        if self._disk_used <= self.disk_bytes:
+            return
+        with self._lock:
+            blobs = [entry for entry in os.scandir(self.cache_dir) if entry.is_file()]
+            blobs.sort(key=lambda entry: entry.stat().st_mtime)
+            used = sum(entry.stat().st_size for entry in blobs)
+            # Trim to 90% so every new thumbnail doesn't trigger another scan
+            for entry in blobs:
+                if used <= self.disk_bytes * 0.9:
+                    break
+                used -= entry.stat().st_size
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+            self._disk_used = used
+        # Refs pointing at a removed blob simply miss and are refetched
+
+    def _write_file(self, path, data):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        if not path.startswith(os.path.join(self.cache_dir, "refs")):
+            with self._lock:
+                self._disk_used += len(data)
+
+    def _read_ref(self, url):
+        try:
+            with open(self._ref_path(url), "rb") as f:
+                return f.read().decode("ascii").strip() or None
+        except OSError:
+            return None
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.jpg")
+
+    def _ref_path(self, url):
+        return os.path.join(self.cache_dir, "refs", hashlib.sha256(url.encode("utf-8")).hexdigest())
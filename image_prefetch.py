@@ -0,0 +1,221 @@
+"""Early checks of image messages.
+
+An image message is only a URL, which the backend fetches itself. To catch
+dead links, non-images and oversized files before they cost a backend round
+trip, the URL is probed as soon as the message is sent: a HEAD request and
+a ranged GET of the first PROBE_BYTES run in parallel, and Pillow reads the
+format and dimensions from those bytes without decoding the image. The
+verdict is an ImageCheck.
+
+Accepted images are then downloaded once more in the background, downscaled
+and stored in the ThumbnailCache while the backend call proceeds, so the
+chat only ever draws the cached thumbnail and never fetches on a rerun.
+
+Every request goes through image_cache.fetch(), so links to private
+addresses are refused before anything is sent to them.
+"""
+import io
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import requests
+from PIL import Image, UnidentifiedImageError
+
+from image_cache import MAX_DOWNLOAD_BYTES, MAX_PIXELS, BlockedURL, fetch, parse_size, public_session
+
+PROBE_BYTES = 64 * 1024
+PROBE_TIMEOUT = (3, 5)
+
+# Images past either limit are accepted, but flagged as downscaled for display
+LARGE_SIDE = 4096
+LARGE_BYTES = 5 * 1024 * 1024
+
+PREFETCH_WORKERS = 8
+# URLs whose outcome is remembered
+MAX_TRACKED = 1000
+
+
+class ImageCheck:
+    """Outcome of probing one image URL"""
+
+    def __init__(self, url, ok, reason="", content_type="", size=None, width=None, height=None,
+                 format=None, seconds=0.0):
+        self.url = url
+        self.ok = ok
+        self.reason = reason
+        self.content_type = content_type
+        self.size = size
+        self.width = width
+        self.height = height
+        self.format = format
+        self.seconds = seconds
+
+    @property
+    def oversized(self):
+        return (self.size or 0) > LARGE_BYTES or max(self.width or 0, self.height or 0) > LARGE_SIDE
+
+
+def _total_size(response):
+    # 206 answers carry the full size in Content-Range: "bytes 0-65535/1234567"
+    match = re.search(r"/(\d+)$", response.headers.get("Content-Range", ""))
+    if match:
+        return parse_size(match.group(1))
+    if response.status_code == 200:
+        return parse_size(response.headers.get("Content-Length"))
+    return None
+
+
+class ImagePrefetcher:
+    """Probes image URLs and warms their thumbnails on a small thread pool
+
+    check() waits for the probe only; ready() also waits for the thumbnail.
+    """
+
+    def __init__(self, thumbnails, workers=PREFETCH_WORKERS):
+        self.thumbnails = thumbnails
+        self.session = public_session(pool_maxsize=2 * workers)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sadhak-prefetch")
+        # HEAD and ranged GET of each probe; separate so a busy _pool can't starve them
+        self._probes = ThreadPoolExecutor(max_workers=2 * workers, thread_name_prefix="sadhak-probe")
+        self._lock = threading.Lock()
+        # url -> Future of its ImageCheck
+        self._checks = OrderedDict()
+        # Accepted URLs whose thumbnail is still being made
+        self._warming = set()
+        self._accepted = 0
+        self._rejected = 0
+
+    def submit(self, url):
+        """Start probing url (once); returns the Future of its ImageCheck"""
+        with self._lock:
+            future = self._checks.get(url)
+            if future is not None:
+                self._checks.move_to_end(url)
+                return future
+            future = self._checks[url] = self._pool.submit(self._check, url)
+            while len(self._checks) > MAX_TRACKED:
+                self._checks.popitem(last=False)
+            return future
+
+    def check(self, url, timeout=None):
+        """The ImageCheck of url, waiting up to timeout seconds; None if it isn't ready"""
+        future = self.submit(url)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            return None
+
+    def ready(self, url):
+        """The ImageCheck of url once it and the thumbnail are done, without waiting
+
+        Starts a probe if url hasn't been seen yet.
+        """
+        future = self.submit(url)
+        if not future.done():
+            return None
+        with self._lock:
+            if url in self._warming:
+                return None
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            return {"accepted": self._accepted, "rejected": self._rejected, "tracked": len(self._checks)}
+
+    def _check(self, url):
+        try:
+            check = self.probe(url)
+        except Exception as e:
+            # Stored in the future, an error would be raised again on every rerun that draws the message
+            check = ImageCheck(url, False, f"could not be checked ({type(e).__name__})")
+        with self._lock:
+            if check.ok:
+                self._accepted += 1
+                # Full download and downscale, off the render path and without
+                # holding up whoever waits for the verdict
+                self._warming.add(url)
+                self._pool.submit(self._warm, url)
+            else:
+                self._rejected += 1
+        return check
+
+    def _warm(self, url):
+        try:
+            self.thumbnails.get(url)
+        finally:
+            with self._lock:
+                self._warming.discard(url)
+
+    def probe(self, url):
+        """HEAD and the first PROBE_BYTES in parallel, then the verdict"""
+        started = time.monotonic()
+        head = self._probes.submit(self._head, url)
+        first = self._probes.submit(self._first_bytes, url)
+        try:
+            response, data = first.result()
+        except BlockedURL as e:
+            head.cancel()
+            return ImageCheck(url, False, str(e), seconds=time.monotonic() - started)
+        except requests.exceptions.RequestException as e:
+            head.cancel()
+            return ImageCheck(url, False, f"could not be loaded ({type(e).__name__})", seconds=time.monotonic() - started)
+        head_response = head.result()
+
+        def verdict(ok, reason="", **info):
+            return ImageCheck(url, ok, reason, seconds=time.monotonic() - started, **info)
+
+        if response.status_code >= 400:
+            return verdict(False, f"the link answered HTTP {response.status_code}")
+
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        size = _total_size(response)
+        # Some servers answer HEAD with a 405; only trust a successful one
+        if head_response is not None and head_response.ok:
+            content_type = content_type or head_response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if size is None:
+                size = parse_size(head_response.headers.get("Content-Length"))
+        if size is not None and size > MAX_DOWNLOAD_BYTES:
+            return verdict(False, f"the image is too large ({size / 1024 / 1024:.0f} MB)", content_type=content_type, size=size)
+
+        try:
+            # Image.open only parses the header; nothing is decoded here
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size
+                image_format = image.format
+        except Image.DecompressionBombError:
+            return verdict(False, "the image is too large", content_type=content_type, size=size)
+        except (UnidentifiedImageError, OSError, ValueError):
+            if content_type.startswith("image/") and len(data) >= PROBE_BYTES:
+                # The header may lie past the first bytes (large EXIF blocks): let the download decide
+                return verdict(True, content_type=content_type, size=size)
+            return verdict(False, f"the link is not an image ({content_type or 'unknown type'})", content_type=content_type, size=size)
+
+        if width * height > MAX_PIXELS:
+            return verdict(
+                False, f"the image is too large ({width}x{height} pixels)",
+                content_type=content_type, size=size, width=width, height=height, format=image_format,
+            )
+        return verdict(True, content_type=content_type, size=size, width=width, height=height, format=image_format)
+
+    def _head(self, url):
+        try:
+            response = fetch(self.session, "HEAD", url, timeout=PROBE_TIMEOUT)
+            response.close()
+            return response
+        except (requests.exceptions.RequestException, BlockedURL):
+            return None
+
+    def _first_bytes(self, url):
+        headers = {"Range": f"bytes=0-{PROBE_BYTES - 1}"}
+        with fetch(self.session, "GET", url, headers=headers, timeout=PROBE_TIMEOUT, stream=True) as response:
+            data = b""
+            if response.status_code < 400:
+                # A server that ignores Range sends the whole file: stop after the first bytes
+                for chunk in response.iter_content(16 * 1024):
+                    data += chunk
+                    if len(data) >= PROBE_BYTES:
+                        break
+            return response, data[:PROBE_BYTES]
@@ -0,0 +1,123 @@
+"""Execution log viewer of assistant replies.
+
+The whole log of a reply (the waterfall of client-side phases plus one
+table row per backend step, with the step's duration taken from the log
+times) is built as a single HTML block. Blocks are built the first time a
+reply's log is opened and kept in a small per-session LRU, so reopening it,
+or rerunning while it stays open, costs a lookup and one st.markdown call.
+"""
+import html
+from collections import OrderedDict
+
+from timings import parse_clock
+
+# Blocks kept per session; only logs that were opened are built at all
+MAX_VIEWS = 50
+
+# Waterfall of the client-side phases, with the backend's log steps inside "wait"
+WATERFALL_COLORS = {"wait": "#075E54", "render": "#B8860B"}
+
+
+def step_durations(execution_log):
+    """(time, message, seconds) per log entry: the time until the next entry
+
+    The last step, and steps whose times don't parse, get None.
+    """
+    clocks = [parse_clock(log_time) for log_time, _ in execution_log]
+    steps = []
+    for i, (log_time, log_message) in enumerate(execution_log):
+        seconds = None
+        if i + 1 < len(clocks) and clocks[i] is not None and clocks[i + 1] is not None:
+            # Log times have no date: a negative step crossed midnight
+            seconds = (clocks[i + 1] - clocks[i]) % 86400
+        steps.append((log_time, log_message, seconds))
+    return steps
+
+
+def waterfall_row(label, start, width, seconds, color, title=""):
+    return (
+        f'<div style="display: flex; align-items: center; font-size: 0.78em; font-family: monospace; margin: 1px 0;" title="{html.escape(title)}">'
+        f'<span style="width: 150px; color: #555; overflow: hidden; white-space: nowrap; text-overflow: ellipsis;">{html.escape(label)}</span>'
+        f'<span style="flex: 1; position: relative; height: 10px; background: #f3f3f3;">'
+        f'<span style="position: absolute; left: {start:.2%}; width: {max(width, 0.004):.2%}; height: 100%; background: {color};"></span></span>'
+        f'<span style="width: 70px; text-align: right; color: #888;">{seconds * 1000:.0f} ms</span>'
+        f'</div>'
+    )
+
+
+def waterfall_html(timings, execution_log):
+    total = sum(seconds for _, seconds in timings) or 1e-9
+    clocks = [parse_clock(log_time) for log_time, _ in execution_log]
+    rows = []
+    offset = 0.0
+    for phase, seconds in timings:
+        rows.append(waterfall_row(phase, offset / total, seconds / total, seconds, WATERFALL_COLORS.get(phase, "#128C7E")))
+        if phase == "wait" and execution_log and None not in clocks:
+            # The backend's last step happens just before the answer goes out,
+            # so line the steps up against the end of the wait
+            last = clocks[-1]
+            for i, (clock, (_, log_message)) in enumerate(zip(clocks, execution_log)):
+                step = (clocks[i + 1] if i + 1 < len(clocks) else last) - clock
+                start = max(offset + seconds - (last - clock), offset)
+                rows.append(waterfall_row(f"  ↳ {log_message}", start / total, step / total, step, "#9BC9C2", log_message))
+        offset += seconds
+    return "".join(rows)
+
+
+def steps_html(execution_log):
+    """The backend's steps as one table: time, step, duration"""
+    steps = step_durations(execution_log)
+    known = [seconds for _, _, seconds in steps if seconds is not None]
+    rows = "".join(
+        f'<tr style="border-bottom: 1px solid #eee;">'
+        f'<td style="color: #888; padding: 3px 8px 3px 0; white-space: nowrap;">⏱ {html.escape(log_time)}</td>'
+        f'<td style="color: #333; padding: 3px 8px;">{html.escape(log_message)}</td>'
+        f'<td style="color: #888; padding: 3px 0; text-align: right; white-space: nowrap;">'
+        f'{"" if seconds is None else f"{seconds * 1000:.0f} ms"}</td>'
+        f'</tr>'
+        for log_time, log_message, seconds in steps
+    )
+    footer = ""
+    if known:
+        footer = (
+            f'<tr><td></td><td style="color: #555; padding: 3px 8px;">{len(steps)} steps</td>'
+            f'<td style="color: #555; padding: 3px 0; text-align: right; white-space: nowrap;">{sum(known) * 1000:.0f} ms</td></tr>'
+        )
+    return (
+        f'<table style="width: 100%; border-collapse: collapse; font-size: 0.82em; font-family: monospace; margin-top: 6px;">'
+        f'{rows}{footer}</table>'
+    )
+
+
+def execution_log_html(timings, execution_log):
+    """Waterfall and step table of one reply"""
+    parts = []
+    if timings:
+        parts.append(waterfall_html(timings, execution_log))
+    if execution_log:
+        parts.append(steps_html(execution_log))
+    return "".join(parts)
+
+
+class LogViews:
+    """LRU of built log blocks, by message"""
+
+    def __init__(self, max_views=MAX_VIEWS):
+        self.max_views = max_views
+        self._views = OrderedDict()
+
+    def get(self, message):
+        # The render phase is added to timings after the first draw
+        key = (message.id, len(message.timings))
+        view = self._views.get(key)
+        if view is None:
+            view = execution_log_html(message.timings, message.execution_log)
+            self._views[key] = view
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+        else:
+            self._views.move_to_end(key)
+        return view
+
+    def __len__(self):
+        return len(self._views)
@@ -0,0 +1,251 @@
+"""Compact per-session chat history.
+
+Messages are slotted ChatMessage records with epoch timestamps (formatted only
+when rendered) and interned role / classification labels. Each MessageStore
+keeps at most MEMORY_CAP_BYTES of messages in RAM; older ones are spilled to a
+JSONL file on disk and read back only when the user scrolls up to them.
+
+A store can also be backed by a HistoryDB (see history_db.py): every message
+is then written through to SQLite, which takes the place of the spill file.
+
+The messages held in RAM also have their rendered time and classification
+block cached in the store's RenderCache (see render_cache.py), which drops
+it when they spill. The blocks count toward the store's memory cap too.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+from datetime import datetime
+
+from render_cache import RenderCache, render
+
+# Approximate RAM budget for one session's history
+MEMORY_CAP_BYTES = 256 * 1024
+
+SPILL_DIR = os.path.join(tempfile.gettempdir(), "sadhak_spill")
+
+# Rough per-record overhead (object, slots, tuple headers)
+_RECORD_OVERHEAD = 200
+
+
+def _label(value):
+    """Intern short repeated labels so every message shares one copy"""
+    return sys.intern(value) if value else ""
+
+
+class ChatMessage:
+    """One chat history entry"""
+
+    __slots__ = (
+        "id", "role", "content", "ts", "image_url",
+        "classification", "sub_classification", "confidence", "execution_log", "timings",
+    )
+
+    def __init__(self, role, content, ts=None, image_url="", classification="",
+                 sub_classification="", confidence="", execution_log=(), timings=(), id=None):
+        # Random rather than a counter: it stays the same when the message is
+        # read back from the spill file or the history database, across restarts
+        self.id = id or uuid.uuid4().hex
+        self.role = _label(role)
+        self.content = content
+        self.ts = ts or time.time()
+        self.image_url = image_url or ""
+        self.classification = _label(classification)
+        self.sub_classification = _label(sub_classification)
+        self.confidence = _label(confidence)
+        # (time, message) pairs from the backend's execution_log
+        self.execution_log = tuple(
+            (entry.get("time", ""), entry.get("message", "")) if isinstance(entry, dict) else tuple(entry)
+            for entry in execution_log
+        )
+        # Client-side (phase, seconds) pairs, see timings.py
+        self.timings = tuple((phase, seconds) for phase, seconds in timings)
+
+    @property
+    def has_image(self):
+        return bool(self.image_url)
+
+    @property
+    def time_label(self):
+        return datetime.fromtimestamp(self.ts).strftime("%I:%M %p")
+
+    def size(self):
+        """Approximate RAM footprint in bytes"""
+        log = sum(len(t) + len(m) for t, m in self.execution_log)
+        # Flat allowance for timings, which gain a "render" entry after append
+        timings = 320 if self.timings else 0
+        return _RECORD_OVERHEAD + len(self.content) + len(self.image_url) + log + timings
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "role": self.role,
+            "content": self.content,
+            "ts": self.ts,
+            "image_url": self.image_url,
+            "classification": self.classification,
+            "sub_classification": self.sub_classification,
+            "confidence": self.confidence,
+            "execution_log": [list(entry) for entry in self.execution_log],
+            "timings": [list(entry) for entry in self.timings],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class MessageStore:
+    """Session history: newest messages in RAM, the rest spilled to disk"""
+
+    def __init__(self, memory_cap=MEMORY_CAP_BYTES, db=None, key=None):
+        self.memory_cap = memory_cap
+        # Optional HistoryDB and the (mobile_no, ng_code) conversation key
+        self.db = db
+        self.key = key
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._recent_bytes = 0
+        self._counts = {}
+        self._spilled = 0
+        # Byte offsets of spilled messages in the spill file, oldest first
+        self._offsets = []
+        self._spill_path = None
+        self._finalizer = None
+        self.render_cache = RenderCache()
+
+    @classmethod
+    def load(cls, db, key, memory_cap=MEMORY_CAP_BYTES):
+        """Reopen a stored conversation, reading only its newest messages"""
+        store = cls(memory_cap, db, key)
+        db.flush()
+        counts = db.count(key)
+        total = sum(counts.values())
+        recent = []
+        size = 0
+        # Walk back from the newest message until the RAM budget is used up
+        full = False
+        while len(recent) < total and not full:
+            chunk = db.before(key, recent[-1][0].id if recent else None)
+            if not chunk:
+                break
+            for message in reversed(chunk):
+                block = render(message)
+                if recent and size + message.size() + len(block) > memory_cap:
+                    full = True
+                    break
+                recent.append((message, block))
+                size += message.size() + len(block)
+        recent.reverse()
+        for message, block in recent:
+            store.render_cache.add(message, block)
+        store._recent.extend(message for message, _ in recent)
+        store._recent_bytes = size
+        store._counts = counts
+        store._spilled = total - len(recent)
+        return store
+
+    def __len__(self):
+        return self._spilled + len(self._recent)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        return iter(self.page(0, len(self)))
+
+    def append(self, message):
+        with self._lock:
+            if self.db is not None:
+                self.db.add(self.key, message)
+            self._recent.append(message)
+            self._recent_bytes += message.size() + len(self.render_cache.add(message))
+            self._counts[message.role] = self._counts.get(message.role, 0) + 1
+            # Always keep the newest message in RAM
+            while self._recent_bytes > self.memory_cap and len(self._recent) > 1:
+                self._spill(self._recent.popleft())
+
+    def count(self, role):
+        return self._counts.get(role, 0)
+
+    @property
+    def memory_bytes(self):
+        return self._recent_bytes
+
+    @property
+    def spilled(self):
+        return self._spilled
+
+    def tail(self, n):
+        """The newest n messages, oldest first"""
+        total = len(self)
+        return self.page(max(total - n, 0), total)
+
+    def page(self, start, stop):
+        """Messages [start, stop), reading spilled ones back from disk"""
+        with self._lock:
+            spilled = self._spilled
+            result = []
+            if start < spilled:
+                result.extend(self._read_spilled(start, min(stop, spilled)))
+            recent = list(self._recent)
+            result.extend(recent[max(start - spilled, 0):max(stop - spilled, 0)])
+            return result
+
+    def clear(self):
+        with self._lock:
+            if self.db is not None:
+                self.db.delete(self.key)
+            self._recent.clear()
+            self._recent_bytes = 0
+            self.render_cache.clear()
+            self._counts = {}
+            self._spilled = 0
+            self._offsets = []
+            if self._finalizer is not None:
+                self._finalizer()
+                self._finalizer = None
+            self._spill_path = None
+
+    def _spill(self, message):
+        self._spilled += 1
+        self._recent_bytes -= message.size() + self.render_cache.evict(message)
+        if self.db is not None:
+            # Already written through to the database
+            return
+        if self._spill_path is None:
+            os.makedirs(SPILL_DIR, exist_ok=True)
+            fd, self._spill_path = tempfile.mkstemp(prefix="history-", suffix=".jsonl", dir=SPILL_DIR)
+            os.close(fd)
+            # Remove the file once the session (and this store) goes away
+            self._finalizer = weakref.finalize(self, _remove_file, self._spill_path)
+        with open(self._spill_path, "ab") as f:
+            self._offsets.append(f.tell())
+            f.write(json.dumps(message.to_dict(), ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def _read_spilled(self, start, stop):
+        if self.db is not None:
+            self.db.flush()
+            # Counted back from the oldest message in RAM, not from the end of
+            # the conversation, which other writers may have added to since
+            anchor = self._recent[0].id if self._recent else None
+            return self.db.before(self.key, anchor, stop - start, self._spilled - stop)
+        messages = []
+        with open(self._spill_path, "rb") as f:
+            f.seek(self._offsets[start])
+            for _ in range(start, stop):
+                messages.append(ChatMessage.from_dict(json.loads(f.readline())))
+        return messages
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,165 @@
+"""Process-wide metrics in the Prometheus / OpenMetrics text format.
+
+Nothing is computed on the request path beyond a few counter increments:
+the registry pulls gauges and histograms from the live objects (client pool,
+dispatcher, caches, ...) only when the metrics are scraped or written out.
+
+    SADHAK_METRICS_PORT=9108          serve http://<host>:9108/metrics
+    SADHAK_METRICS_FILE=metrics.prom  rewrite this file every 15 s
+"""
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.environ.get("SADHAK_METRICS_PORT") or 0)
+METRICS_FILE = os.environ.get("SADHAK_METRICS_FILE", "")
+FILE_INTERVAL = 15
+
+# A session counts as active if it ran the script this recently
+SESSION_ACTIVE_SECONDS = 300
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class SessionTracker:
+    """Last-seen time and message store size of every browser session"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def touch(self, session_id, store_bytes):
+        with self._lock:
+            self._sessions[session_id] = (time.time(), store_bytes)
+
+    def snapshot(self):
+        """(active sessions, message store bytes held by them)"""
+        cutoff = time.time() - SESSION_ACTIVE_SECONDS
+        with self._lock:
+            for session_id in [s for s, (seen, _) in self._sessions.items() if seen < cutoff]:
+                del self._sessions[session_id]
+            return len(self._sessions), sum(size for _, size in self._sessions.values())
+
+
+class MetricsRegistry:
+    """Counters incremented in place plus collectors read at scrape time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._help = {}
+        self._collectors = []
+        self.sessions = SessionTracker()
+
+    def inc(self, name, help_text="", value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def add_collector(self, collector):
+        """collector() yields (name, type, help, [(labels dict, value), ...])
+
+        Histograms use type "histogram" and a value of (buckets, sum, count),
+        buckets being cumulative (upper bound, count) pairs.
+        """
+        self._collectors.append(collector)
+
+    def render(self, openmetrics=False):
+        families = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                family = families.setdefault(name, ("counter", self._help.get(name, ""), []))
+                family[2].append((dict(labels), value))
+        for collector in self._collectors:
+            try:
+                for name, kind, help_text, samples in collector():
+                    families[name] = (kind, help_text, list(samples))
+            except Exception as e:
+                families.setdefault("sadhak_metrics_collector_errors", ("gauge", "Collectors that failed", []))[2].append(
+                    ({"error": type(e).__name__}, 1)
+                )
+
+        lines = []
+        for name in sorted(families):
+            kind, help_text, samples = families[name]
+            family_name = name[:-len("_total")] if openmetrics and kind == "counter" and name.endswith("_total") else name
+            if help_text:
+                lines.append(f"# HELP {family_name} {_escape_help(help_text)}")
+            lines.append(f"# TYPE {family_name} {kind}")
+            for labels, value in samples:
+                if kind == "histogram":
+                    buckets, total, count = value
+                    for bound, cumulative in buckets:
+                        lines.append(_sample(f"{name}_bucket", dict(labels, le=_number(bound)), cumulative))
+                    lines.append(_sample(f"{name}_sum", labels, total))
+                    lines.append(_sample(f"{name}_count", labels, count))
+                else:
+                    lines.append(_sample(name, labels, value))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="0.0.0.0"):
+        """Serve /metrics on a side port from a daemon thread"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = registry.render(openmetrics).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="sadhak-metrics", daemon=True).start()
+        return server
+
+    def write_periodically(self, path, interval=FILE_INTERVAL):
+        """Rewrite path with the current metrics every interval seconds"""
+        def loop():
+            while True:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(self.render())
+                os.replace(tmp_path, path)
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name="sadhak-metrics-file", daemon=True).start()
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _sample(name, labels, value):
+    if labels:
+        rendered = ",".join(f'{key}="{_escape_label(str(val))}"' for key, val in sorted(labels.items()))
+        return f"{name}{{{rendered}}} {_number(value)}"
+    return f"{name} {_number(value)}"
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
@@ -0,0 +1,206 @@
+"""Durable outbox for messages the backend could not take.
+
+When a /message call fails in a way that may succeed later (connection
+error, timeout, 5xx, open circuit) the payload is stored in a small SQLite
+database instead of being lost. A background thread checks the backend's
+health every FLUSH_INTERVAL seconds while the outbox is not empty, and once
+it answers resends the messages in batches.
+
+Messages of one conversation (mobile_no, ng_code) are resent strictly in
+the order they were saved, and a new message of a conversation that still
+has saved ones is queued behind them. Replies go to deliver(), which hands
+them to the sending session, or to the history database when the session
+is gone. The WA_Message_Id is kept, so a resend the backend already
+processed is recognised as the same message.
+
+    SADHAK_OUTBOX_DB=path   database file (default: sadhak_outbox.db)
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+OUTBOX_PATH = os.environ.get("SADHAK_OUTBOX_DB", "sadhak_outbox.db")
+
+FLUSH_INTERVAL = 15.0
+BATCH_SIZE = 50
+# Conversations resent in parallel; each one is still sent in order
+FLUSH_WORKERS = 4
+# Saved messages older than this are given up on
+MAX_AGE = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    mobile_no TEXT NOT NULL,
+    ng_code INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_conversation ON outbox (mobile_no, ng_code, id);
+CREATE INDEX IF NOT EXISTS idx_outbox_session ON outbox (session_id);
+"""
+
+
+class Outbox:
+    """SQLite-backed queue of unsent messages with a background resender
+
+    send(payload) returns the /message result or raises; retryable(error)
+    tells whether to try again later; deliver(session_id, payload, result,
+    error) receives each message's outcome; healthy() gates every flush.
+    """
+
+    def __init__(self, send, deliver, retryable, healthy, path=OUTBOX_PATH,
+                 interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE, max_age=MAX_AGE):
+        self.send = send
+        self.deliver = deliver
+        self.retryable = retryable
+        self.healthy = healthy
+        self.path = path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._delivered = 0
+        self._given_up = 0
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        conn.commit()
+        # Messages left over from an earlier run are picked up as well
+        self._size = conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+        self._thread = threading.Thread(target=self._run, name="sadhak-outbox", daemon=True)
+        self._thread.start()
+
+    def _conn(self):
+        """One connection per thread (sqlite3 connections are not shareable)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, session_id, payload, error=None):
+        """Save a message that could not be sent"""
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute(
+                "INSERT INTO outbox (session_id, mobile_no, ng_code, payload, created, last_error) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    session_id, payload["MobileNo"], int(payload["NGCode"] or 0),
+                    json.dumps(payload, ensure_ascii=False), time.time(), str(error or ""),
+                ),
+            )
+            conn.commit()
+        with self._lock:
+            self._size += 1
+
+    def holds(self, mobile_no, ng_code):
+        """True while the conversation has saved messages (new ones must queue behind them)"""
+        if not self._size:
+            return False
+        row = self._conn().execute(
+            "SELECT 1 FROM outbox WHERE mobile_no = ? AND ng_code = ? LIMIT 1", (mobile_no, int(ng_code or 0))
+        ).fetchone()
+        return row is not None
+
+    def waiting(self, session_id):
+        """Saved messages of the session"""
+        if not self._size:
+            return 0
+        return self._conn().execute("SELECT COUNT(*) FROM outbox WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def wake(self):
+        """Flush now instead of at the next interval"""
+        self._wake.set()
+
+    def flush(self):
+        """Resend one batch; returns the number of messages that went out"""
+        rows = self._conn().execute(
+            "SELECT id, session_id, mobile_no, ng_code, payload, created FROM outbox ORDER BY id LIMIT ?",
+            (self.batch_size,),
+        ).fetchall()
+        conversations = {}
+        for row in rows:
+            conversations.setdefault((row[2], row[3]), []).append(row)
+        if not conversations:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(FLUSH_WORKERS, len(conversations))) as pool:
+            return sum(pool.map(self._flush_conversation, conversations.values()))
+
+    def stats(self):
+        with self._lock:
+            return {"waiting": self._size, "delivered": self._delivered, "given_up": self._given_up}
+
+    def _flush_conversation(self, rows):
+        sent = 0
+        for row_id, session_id, _, _, payload, created in rows:
+            payload = json.loads(payload)
+            try:
+                result = self.send(payload)
+            except Exception as e:
+                if self.retryable(e) and time.time() - created < self.max_age:
+                    self._failed(row_id, e)
+                    # Stop here so later messages of the conversation don't overtake this one
+                    return sent
+                self._remove(row_id)
+                with self._lock:
+                    self._given_up += 1
+                self._deliver(session_id, payload, None, e)
+                continue
+            self._remove(row_id)
+            with self._lock:
+                self._delivered += 1
+            self._deliver(session_id, payload, result, None)
+            sent += 1
+        return sent
+
+    def _deliver(self, session_id, payload, result, error):
+        try:
+            self.deliver(session_id, payload, result, error)
+        except Exception as e:
+            print(f"outbox: delivering a reply failed: {e}", file=sys.stderr)
+
+    def _failed(self, row_id, error):
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?", (str(error), row_id)
+            )
+            conn.commit()
+
+    def _remove(self, row_id):
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+            conn.commit()
+        with self._lock:
+            self._size -= 1
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._size:
+                continue
+            try:
+                if not self.healthy():
+                    continue
+                # Keep going while whole batches get through
+                while self._size and self.flush() == self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"outbox: flush failed: {e}", file=sys.stderr)
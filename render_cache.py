@@ -0,0 +1,63 @@
+"""Pre-rendered footers of chat bubbles.
+
+The body of a message is plain markdown, drawn without unsafe_allow_html
+so any HTML in it is shown as text. Below it goes one HTML block: the time,
+and for replies the classification / sub-classification / confidence lines.
+That block is built once, when the message enters a MessageStore, and kept
+by message id until the message spills to disk or the chat is cleared, so
+redrawing the history on a rerun is a lookup per message.
+"""
+import html
+
+# Looks like st.caption in both the light and the dark theme
+TIME_STYLE = "font-size: 0.875em; opacity: 0.6; margin-top: -8px;"
+META_STYLE = "font-size: 0.85em; color: #555; margin-top: 4px;"
+
+
+def meta_html(message):
+    lines = []
+    if message.classification:
+        lines.append(f"📋 <strong>Classification:</strong> {html.escape(message.classification)}")
+    if message.sub_classification:
+        lines.append(f"📌 <strong>Sub-Classification:</strong> {html.escape(message.sub_classification)}")
+    if message.confidence:
+        lines.append(f"✅ <strong>Confidence:</strong> {html.escape(message.confidence)}")
+    return "".join(f'<div style="{META_STYLE}">{line}</div>' for line in lines)
+
+
+def render(message):
+    """The HTML drawn under the body of a message: its time and classification"""
+    return f'<div style="{TIME_STYLE}">{message.time_label}</div>{meta_html(message)}'
+
+
+class RenderCache:
+    """Rendered time and classification blocks of the messages a store keeps in RAM, by message id"""
+
+    def __init__(self):
+        self._blocks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, message, block=None):
+        """Cache the block of message (block, if it is already built); returns it"""
+        block = self._blocks[message.id] = block or render(message)
+        return block
+
+    def get(self, message):
+        block = self._blocks.get(message.id)
+        if block is None:
+            # Read back from disk or the history database
+            self.misses += 1
+            return render(message)
+        self.hits += 1
+        return block
+
+    def evict(self, message):
+        """Drop the block of message; returns its size, for the store's accounting"""
+        return len(self._blocks.pop(message.id, ""))
+
+    def clear(self):
+        self._blocks.clear()
+
+    def __len__(self):
+        return len(self._blocks)
@@ -0,0 +1,178 @@
+"""Opt-in profiler for Streamlit script reruns.
+
+Every interaction reruns streamlit_code.py from the top. With SADHAK_PROFILE
+set, each rerun is split into named sections (css, state, resources,
+sidebar, header, chat, form, footer) and every rendered message is timed as
+well. Runs are appended to a JSONL trace file and summarised in the
+sidebar's debug panel.
+
+    SADHAK_PROFILE=1          section and message timings
+    SADHAK_PROFILE=cprofile   ... plus the top functions of a cProfile capture
+    SADHAK_PROFILE_FILE=path  trace file (default: sadhak_rerun_trace.jsonl)
+
+Fragment-only reruns (the chat area polling for replies) are recorded as
+runs of kind "fragment". A run cut short by st.rerun() is written out as
+interrupted when the session's next run starts.
+"""
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+PROFILE = os.environ.get("SADHAK_PROFILE", "")
+TRACE_FILE = os.environ.get("SADHAK_PROFILE_FILE", "sadhak_rerun_trace.jsonl")
+
+# Runs kept per section for the p50 / p95 in the debug panel
+WINDOW = 200
+TOP_FUNCTIONS = 20
+
+
+class Run:
+    """Timings of one script run; section() closes the previous section"""
+
+    def __init__(self, profiler, kind, capture=None):
+        self.profiler = profiler
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.sections = {}
+        self.messages = []
+        self.record = None
+        self._section = None
+        self._section_started = self.started
+        self._capture = capture
+
+    @property
+    def finished(self):
+        return self.record is not None
+
+    def section(self, name):
+        now = time.perf_counter()
+        if self._section is not None:
+            self.sections[self._section] = self.sections.get(self._section, 0.0) + now - self._section_started
+        self._section = name
+        self._section_started = now
+
+    def message(self, message_id, seconds):
+        self.messages.append((message_id, seconds))
+
+    def finish(self, interrupted=False, **extra):
+        """Close the run, write it to the trace and return its record"""
+        if self.finished:
+            return self.record
+        self.section(None)
+        record = {
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "kind": self.kind,
+            "interrupted": interrupted,
+            "total_ms": _ms(time.perf_counter() - self.started),
+            "sections": {name: _ms(seconds) for name, seconds in self.sections.items()},
+            "messages": [{"id": message_id, "ms": _ms(seconds)} for message_id, seconds in self.messages],
+        }
+        record.update(extra)
+        if self._capture is not None:
+            record["cprofile"] = self.profiler._release(self._capture)
+            self._capture = None
+        self.record = record
+        self.profiler._add(record)
+        return record
+
+
+class _NullRun:
+    """Stand-in used while profiling is off"""
+
+    kind = None
+    record = None
+    finished = True
+
+    def section(self, name):
+        pass
+
+    def message(self, message_id, seconds):
+        pass
+
+    def finish(self, interrupted=False, **extra):
+        return None
+
+
+NULL_RUN = _NullRun()
+
+
+class RerunProfiler:
+    """Process-wide collector of rerun timings"""
+
+    def __init__(self, mode=PROFILE, trace_path=TRACE_FILE, window=WINDOW):
+        self.enabled = bool(mode)
+        self.cprofile = mode == "cprofile"
+        self.trace_path = trace_path
+        self.window = window
+        self._lock = threading.Lock()
+        # Only one cProfile capture runs at a time
+        self._capture_lock = threading.Lock()
+        self._samples = {}
+
+    def start(self, kind="full", previous=None):
+        """Begin timing a run; previous is the session's last run, if any"""
+        if not self.enabled:
+            return NULL_RUN
+        if previous is not None and not previous.finished:
+            previous.finish(interrupted=True)
+        capture = None
+        if self.cprofile and self._capture_lock.acquire(blocking=False):
+            capture = cProfile.Profile()
+            capture.enable()
+        return Run(self, kind, capture)
+
+    def summary(self):
+        """{name: {"count", "p50", "p95"}} in ms, for run totals, sections and messages"""
+        with self._lock:
+            snapshot = {name: sorted(samples) for name, samples in self._samples.items() if samples}
+        return {
+            name: {
+                "count": len(samples),
+                "p50": samples[min(int(0.50 * len(samples)), len(samples) - 1)],
+                "p95": samples[min(int(0.95 * len(samples)), len(samples) - 1)],
+            }
+            for name, samples in snapshot.items()
+        }
+
+    def _add(self, record):
+        prefix = "" if record["kind"] == "full" else f"{record['kind']}:"
+        with self._lock:
+            if not record["interrupted"]:
+                self._sample(prefix + "total", record["total_ms"])
+            for name, ms in record["sections"].items():
+                self._sample(prefix + name, ms)
+            for message in record["messages"]:
+                self._sample("message", message["ms"])
+            if self.trace_path:
+                with open(self.trace_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def _sample(self, name, ms):
+        self._samples.setdefault(name, deque(maxlen=self.window)).append(ms)
+
+    def _release(self, capture):
+        """Stop a cProfile capture and return its most expensive functions"""
+        try:
+            capture.disable()
+            stats = pstats.Stats(capture).stats
+        finally:
+            self._capture_lock.release()
+        top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        return [
+            {
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": calls,
+                "own_ms": _ms(own),
+                "cumulative_ms": _ms(cumulative),
+            }
+            for (filename, line, name), (_, calls, own, cumulative, _) in top
+        ]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
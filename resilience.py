@@ -0,0 +1,260 @@
+"""Retries, hedging and a circuit breaker around /message calls.
+
+A ResiliencePolicy wraps a callable that performs one HTTP attempt and
+returns the response. It is called with the seconds left until the overall
+deadline, which the attempt uses to cap its read timeout, so a hung backend
+can't hold the caller much past the deadline. The same payload (and so the
+same WA_Message_Id) is sent on every attempt, which lets the backend treat
+retries and hedges as one logical message.
+
+- Connection errors, timeouts and 502/503/504 answers are retried a bounded
+  number of times with full-jitter exponential backoff, within an overall
+  deadline. Any 5xx answer counts as a failure for the circuit breaker.
+- With hedging on, a second identical attempt is started when the first has
+  not answered within the observed p95 latency; whichever answers first wins.
+  Attempts then run on a pool of two threads per admission slot, so every
+  call the gate lets through can have its primary and its hedge running.
+- After repeated failures the circuit opens and calls fail fast with
+  CircuitOpenError until a cool-down has passed.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from admission import MAX_CONCURRENT
+
+RETRIES = int(os.environ.get("SADHAK_RETRIES", 2))
+BASE_DELAY = 0.5
+MAX_DELAY = 4.0
+
+# No new attempt is started after this many seconds, and none reads past it
+DEADLINE = 120.0
+# Read timeout of an attempt started just before the deadline
+MIN_ATTEMPT_SECONDS = 1.0
+
+HEDGE = os.environ.get("SADHAK_HEDGE", "") == "1"
+HEDGE_PERCENTILE = 0.95
+MIN_HEDGE_DELAY = 1.0
+# Latency samples needed before hedging kicks in
+MIN_HEDGE_SAMPLES = 20
+
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+RETRYABLE_STATUS = (502, 503, 504)
+RETRYABLE_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class CircuitOpenError(Exception):
+    """The backend is failing; calls are refused until the cool-down ends"""
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, lets a trial call through after a cool-down"""
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def check(self):
+        """Raise CircuitOpenError while the circuit is open"""
+        if self.state == "open":
+            raise CircuitOpenError("backend unavailable, failing fast")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            half_open = (
+                self._opened_at is not None
+                and time.monotonic() - self._opened_at >= self.reset_timeout
+            )
+            if self._failures >= self.failure_threshold or half_open:
+                self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Rolling window of call latencies"""
+
+    def __init__(self, size=200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(int(p * len(samples)), len(samples) - 1)]
+
+
+class ResiliencePolicy:
+    """Process-wide retry / hedge / circuit-breaker policy"""
+
+    def __init__(self, retries=RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY, deadline=DEADLINE,
+                 hedge=HEDGE, breaker=None, workers=2 * MAX_CONCURRENT):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        # One latency window per kind of call ("post" answers vs "stream" headers)
+        self._latencies = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sadhak-hedge")
+        self._lock = threading.Lock()
+        self._retries = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._fast_failures = 0
+
+    def latencies(self, kind):
+        with self._lock:
+            return self._latencies.setdefault(kind, LatencyTracker())
+
+    def call(self, attempt, kind="post"):
+        """Run attempt(seconds left) with retries; returns the response or raises the last error"""
+        try:
+            self.breaker.check()
+        except CircuitOpenError:
+            with self._lock:
+                self._fast_failures += 1
+            raise
+
+        started = time.monotonic()
+        for n in range(self.retries + 1):
+            last = n == self.retries
+            remaining = max(self.deadline - (time.monotonic() - started), MIN_ATTEMPT_SECONDS)
+            try:
+                response = self._attempt(partial(attempt, remaining), kind)
+            except RETRYABLE_ERRORS:
+                self.breaker.record_failure()
+                if last or not self._can_retry(n, started):
+                    raise
+            else:
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                # A backend answering 500 to everything is failing too
+                self.breaker.record_failure()
+                if response.status_code not in RETRYABLE_STATUS or last or not self._can_retry(n, started):
+                    return response
+                response.close()
+            with self._lock:
+                self._retries += 1
+            time.sleep(self._backoff(n))
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "retries": self._retries,
+                "hedges": self._hedges,
+                "hedge_wins": self._hedge_wins,
+                "fast_failures": self._fast_failures,
+            }
+        stats["circuit"] = self.breaker.state
+        return stats
+
+    def _can_retry(self, n, started):
+        """Still worth retrying: circuit not open and the deadline not yet near"""
+        if self.breaker.state == "open":
+            return False
+        return time.monotonic() - started + self._backoff_cap(n) < self.deadline
+
+    def _backoff_cap(self, n):
+        return min(self.max_delay, self.base_delay * 2 ** n)
+
+    def _backoff(self, n):
+        # Full jitter keeps retries from many sessions from lining up
+        return random.uniform(0, self._backoff_cap(n))
+
+    def _attempt(self, attempt, kind):
+        latencies = self.latencies(kind)
+        hedge_delay = None
+        if self.hedge and len(latencies) >= MIN_HEDGE_SAMPLES:
+            hedge_delay = max(MIN_HEDGE_DELAY, latencies.percentile(HEDGE_PERCENTILE))
+
+        if hedge_delay is None:
+            response, seconds = _timed(attempt)
+            latencies.add(seconds)
+            return response
+
+        running = threading.Event()
+        primary = self._executor.submit(_timed, attempt, running)
+        primary.add_done_callback(lambda _: running.set())
+        # Time spent waiting for a free thread doesn't count toward the hedge delay
+        running.wait()
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            response, seconds = primary.result()
+            latencies.add(seconds)
+            return response
+
+        with self._lock:
+            self._hedges += 1
+        hedge = self._executor.submit(_timed, attempt)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response, seconds = future.result()
+                except RETRYABLE_ERRORS as e:
+                    error = e
+                    continue
+                if future is hedge:
+                    with self._lock:
+                        self._hedge_wins += 1
+                latencies.add(seconds)
+                for loser in pending:
+                    loser.add_done_callback(_close_response)
+                return response
+        raise error
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _timed(attempt, running=None):
+    """(response, seconds the attempt took)"""
+    if running is not None:
+        running.set()
+    started = time.monotonic()
+    response = attempt()
+    return response, time.monotonic() - started
+
+
+def _close_response(future):
+    """Release the connection held by the losing side of a hedge"""
+    if future.exception() is None:
+        future.result()[0].close()
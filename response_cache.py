@@ -0,0 +1,90 @@
+"""Opt-in cache of backend answers to repeated donor questions.
+
+Keyed on the normalized message text plus the donor's NGCode, so FAQ-style
+questions (receipts, donation status, 80G certificates) asked again within
+the TTL are answered without a backend round trip. Donors without an NGCode
+(0) all share that code, so their answers are keyed on the mobile number
+instead. Only ai_response and ai_reason are kept.
+"""
+import re
+import string
+import threading
+import time
+from collections import OrderedDict
+
+TTL_SECONDS = 15 * 60
+MAX_ENTRIES = 2000
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCTUATION = string.punctuation + "।"
+
+
+def normalize(text):
+    """Case-fold, collapse whitespace and drop surrounding punctuation"""
+    return _SPACES.sub(" ", text.casefold()).strip().strip(_EDGE_PUNCTUATION).strip()
+
+
+def cache_key(text, ng_code, mobile_no):
+    """The donor an answer belongs to: their NGCode, or their mobile number without one"""
+    ng_code = int(ng_code or 0)
+    return normalize(text), ng_code, "" if ng_code else mobile_no
+
+
+class ResponseCache:
+    """TTL + LRU cache of /message results"""
+
+    def __init__(self, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._saved_seconds = 0.0
+
+    def get(self, text, ng_code, mobile_no):
+        """Cached result for the donor's question, or None"""
+        key = cache_key(text, ng_code, mobile_no)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                # A hit saves roughly what the original call took
+                self._saved_seconds += entry[2]
+                return dict(entry[1])
+            if entry is not None:
+                del self._entries[key]
+            self._misses += 1
+            return None
+
+    def put(self, text, ng_code, mobile_no, result, latency):
+        """Remember the result of a backend call that took latency seconds"""
+        key = cache_key(text, ng_code, mobile_no)
+        if not key[0]:
+            return
+        value = {
+            "ai_response": result.get("ai_response", ""),
+            "ai_reason": result.get("ai_reason", ""),
+        }
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value, latency)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "saved_seconds": self._saved_seconds,
+            }
@@ -337,10 +337,40 @@
 
 import streamlit as st
 import requests
-from datetime import datetime
 import json
+import time
 import uuid
 
+from backend_client import BackendClient, BackendError, DEFAULT_API_URL, build_payload, is_url, parse_reply
+from backend_pool import BackendPool
+from dispatcher import Dispatcher
+from history_db import DB_PATH, HistoryDB
+from image_cache import ThumbnailCache, THUMBNAIL_WIDTH
+from image_prefetch import ImagePrefetcher
+from log_view import LogViews
+from resilience import CircuitOpenError, ResiliencePolicy
+from timings import RollingHistograms, ordered
+from metrics import METRICS_FILE, METRICS_PORT, MetricsRegistry
+from response_cache import ResponseCache
+from coalesce import DEDUPE_WINDOW, Coalescer, message_key
+from admission import AdmissionControl, Overloaded
+from outbox import Outbox
+from warmup import BackendWarmer
+from message_store import ChatMessage, MessageStore
+from rerun_profiler import RerunProfiler
+
+# Opt-in rerun profiling (set SADHAK_PROFILE): times every section of each rerun
+@st.cache_resource
+def get_rerun_profiler():
+    """Per-section rerun timings from every session"""
+    return RerunProfiler()
+
+profiler = get_rerun_profiler()
+last_run = st.session_state.get("profile_run")
+rerun = profiler.start("full", last_run)
+st.session_state.profile_run = rerun
+rerun.section("page")
+
 # Page configuration
 st.set_page_config(
     page_title="Narayan Seva Sansthan Chat",
@@ -350,6 +380,7 @@ st.set_page_config(
 )
 
 # Custom CSS for WhatsApp-like UI
+rerun.section("css")
 st.markdown("""
 <style>
     .main {
@@ -408,8 +439,9 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
+rerun.section("state")
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.messages = MessageStore()
 if "mobile_no" not in st.session_state:
     st.session_state.mobile_no = ""
 if "donor_name" not in st.session_state:
@@ -418,15 +450,273 @@ if "ng_code" not in st.session_state:
     st.session_state.ng_code = 0
 if "input_counter" not in st.session_state:
     st.session_state.input_counter = 0
+if "stream_replies" not in st.session_state:
+    st.session_state.stream_replies = True
+if "use_response_cache" not in st.session_state:
+    st.session_state.use_response_cache = False
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+if "log_views" not in st.session_state:
+    st.session_state.log_views = LogViews()
+
+# True while the whole script runs, False during fragment-only reruns
+st.session_state.full_run = True
+
+# Only the newest messages are rendered; older ones load a page at a time
+HISTORY_PAGE_SIZE = 20
+if "history_window" not in st.session_state:
+    st.session_state.history_window = HISTORY_PAGE_SIZE
+
+# Shared keep-alive HTTP client, built once per server process
+rerun.section("resources")
+@st.cache_resource
+def get_backend_client():
+    """Pooled client used by every session on this server"""
+    return BackendClient()
+
+backend = get_backend_client()
+
+# The backend deployments (SADHAK_BACKENDS), picked per conversation by latency and health
+@st.cache_resource
+def get_backend_pool():
+    """Routes every session's calls; health-checks the backends when there are several"""
+    return BackendPool(backend)
+
+backend_pool = get_backend_pool()
+
+# Retries, hedging and circuit breaker shared by every session
+@st.cache_resource
+def get_resilience_policy():
+    """Process-wide policy, so the circuit breaker sees every session's failures"""
+    return ResiliencePolicy()
+
+resilience = get_resilience_policy()
+
+# Client-side latency of recent calls, per phase, across all sessions
+@st.cache_resource
+def get_latency_histograms():
+    """Rolling per-phase latency histograms"""
+    return RollingHistograms()
+
+latency_histograms = get_latency_histograms()
+
+# Shared worker pool that sends messages in the background
+@st.cache_resource
+def get_dispatcher():
+    """Worker pool serving the outbound queue of every session"""
+    return Dispatcher()
+
+dispatcher = get_dispatcher()
+
+# Optional persistent history (set SADHAK_HISTORY_DB to a SQLite file)
+@st.cache_resource
+def get_history_db():
+    """Shared SQLite history, or None when persistence is off"""
+    return HistoryDB(DB_PATH) if DB_PATH else None
+
+history_db = get_history_db()
+
+# Downscaled copies of image messages, shared by all sessions
+@st.cache_resource
+def get_thumbnail_cache():
+    """Memory + disk LRU cache of image thumbnails"""
+    return ThumbnailCache()
+
+thumbnails = get_thumbnail_cache()
+
+# Probes image links when they are sent and makes their thumbnails in the background
+@st.cache_resource
+def get_image_prefetcher():
+    """Shared probe and thumbnail workers"""
+    return ImagePrefetcher(thumbnails)
+
+prefetcher = get_image_prefetcher()
+
+# Longest a message waits for its image probe before going to the backend anyway
+IMAGE_CHECK_WAIT = 5.0
+
+# Answers to repeated questions, shared by all sessions (opt-in per session)
+@st.cache_resource
+def get_response_cache():
+    """TTL + LRU cache of /message answers"""
+    return ResponseCache()
+
+response_cache = get_response_cache()
+
+# In-flight calls by (mobile_no, text), so duplicate submits share one backend call
+@st.cache_resource
+def get_coalescer():
+    """Coalesces duplicate messages from every session"""
+    return Coalescer()
+
+coalescer = get_coalescer()
+
+# Per-donor rate limit and global cap on concurrent backend calls
+@st.cache_resource
+def get_admission_control():
+    """Shared by every session, so the limits hold across browser tabs"""
+    return AdmissionControl()
+
+admission = get_admission_control()
+
+# Failures worth saving the message for and resending later. Not Overloaded:
+# a full admission queue fails fast instead of piling resends onto the spike
+def can_resend(error):
+    if isinstance(error, BackendError):
+        return error.status_code >= 500
+    return isinstance(error, (
+        requests.exceptions.ConnectionError, requests.exceptions.Timeout, CircuitOpenError
+    ))
+
+# Messages the backend could not take, resent once it answers again
+@st.cache_resource
+def get_outbox():
+    """Durable outbox shared by every session (SADHAK_OUTBOX_DB)"""
+    def send(payload):
+        with backend_pool.route(payload) as api_url:
+            response = backend.post(api_url, payload)
+            if response.status_code != 200:
+                response.close()
+                raise BackendError(response.status_code)
+        return backend.decode(response)
+    
+    def deliver(session_id, payload, result, error):
+        if error is None:
+            reply = assistant_message(result)
+        else:
+            reply = ChatMessage("assistant", f"Sorry, your message could not be delivered: {error}")
+        # The sending tab may be closed by now: keep the reply in the saved history instead
+        if not dispatcher.deliver(session_id, reply) and history_db is not None:
+            history_db.add((payload["MobileNo"], int(payload["NGCode"] or 0)), reply)
+    
+    def healthy():
+        return resilience.breaker.state != "open" and backend_pool.check()
+    
+    return Outbox(send, deliver, can_resend, healthy)
 
-# Helper function to check if string is a URL
-def is_url(text):
-    """Check if the given text is a URL"""
-    if not text:
-        return False
-    return text.startswith(('http://', 'https://'))
+outbox = get_outbox()
+
+# Background pinger that keeps the (sleep-when-idle) backend warm
+@st.cache_resource
+def get_backend_warmer():
+    """Started once per server process; pings on a schedule while sessions are active"""
+    return BackendWarmer(backend, DEFAULT_API_URL, pool=backend_pool)
+
+warmer = get_backend_warmer()
+if "warmup_requested" not in st.session_state:
+    st.session_state.warmup_requested = True
+    warmer.session_opened()
+else:
+    warmer.touch()
+
+# Process-wide metrics (set SADHAK_METRICS_PORT and/or SADHAK_METRICS_FILE to export them)
+@st.cache_resource
+def get_metrics():
+    """Registry read by the /metrics side port and the metrics file writer"""
+    registry = MetricsRegistry()
+    
+    def collect():
+        active, store_bytes = registry.sessions.snapshot()
+        yield "sadhak_active_sessions", "gauge", "Sessions that ran in the last 5 minutes", [({}, active)]
+        yield "sadhak_message_store_bytes", "gauge", "In-memory chat history of active sessions", [({}, store_bytes)]
+        
+        pool = backend.stats()
+        yield "sadhak_backend_in_flight", "gauge", "Backend calls in flight", [({}, pool["in_flight"])]
+        yield "sadhak_backend_requests_total", "counter", "Backend calls made", [({}, pool["requests"])]
+        yield "sadhak_backend_connections_opened_total", "counter", "New backend connections", [({}, pool["connections_opened"])]
+        yield "sadhak_backend_idle_connections", "gauge", "Idle keep-alive connections", [({}, pool["idle_connections"])]
+        wire_stats = backend.wire.stats()
+        yield "sadhak_request_body_bytes_total", "counter", "Request bodies before and after compact encoding", [
+            ({"form": "json"}, wire_stats["bytes_raw"]), ({"form": "wire"}, wire_stats["bytes_sent"])
+        ]
+        
+        routing = backend_pool.stats()
+        yield "sadhak_backend_healthy", "gauge", "1 while the backend is in rotation", [
+            ({"backend": b["name"]}, int(b["healthy"])) for b in routing["backends"]
+        ]
+        yield "sadhak_backend_latency_seconds", "gauge", "EWMA latency of calls routed to the backend", [
+            ({"backend": b["name"]}, b["latency"]) for b in routing["backends"] if b["latency"] is not None
+        ]
+        yield "sadhak_backend_routed_total", "counter", "Calls routed to the backend", [
+            ({"backend": b["name"]}, b["requests"]) for b in routing["backends"]
+        ]
+        shadow = routing["shadow"]
+        if shadow is not None:
+            yield "sadhak_shadow_calls_total", "counter", "Calls mirrored to the shadow backend", [
+                ({"outcome": "ok"}, shadow["calls"]), ({"outcome": "error"}, shadow["errors"]), ({"outcome": "dropped"}, shadow["dropped"])
+            ]
+            if shadow["latency"] is not None:
+                yield "sadhak_shadow_latency_seconds", "gauge", "EWMA latency of mirrored calls", [
+                    ({"backend": "shadow"}, shadow["latency"]), ({"backend": "primary"}, shadow["primary_latency"])
+                ]
+        
+        jobs = dispatcher.stats()
+        yield "sadhak_dispatch_jobs", "gauge", "Outbound messages by state", [
+            ({"state": "queued"}, jobs["queued"]), ({"state": "running"}, jobs["running"])
+        ]
+        
+        yield "sadhak_client_phase_seconds", "histogram", "Client-side latency of /message calls by phase", [
+            ({"phase": phase}, value) for phase, value in latency_histograms.cumulative().items()
+        ]
+        
+        cache = response_cache.stats()
+        yield "sadhak_response_cache_lookups_total", "counter", "Response cache lookups", [
+            ({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])
+        ]
+        yield "sadhak_response_cache_saved_seconds_total", "counter", "Backend time saved by cache hits", [({}, cache["saved_seconds"])]
+        yield "sadhak_response_cache_entries", "gauge", "Cached answers", [({}, cache["entries"])]
+        yield "sadhak_coalesced_total", "counter", "Duplicate messages answered by a call already made", [
+            ({}, coalescer.stats()["coalesced"])
+        ]
+        
+        gate = admission.stats()
+        saved = outbox.stats()
+        yield "sadhak_outbox_messages", "gauge", "Messages waiting in the outbox", [({}, saved["waiting"])]
+        yield "sadhak_outbox_resent_total", "counter", "Outbox messages by outcome", [
+            ({"outcome": "delivered"}, saved["delivered"]), ({"outcome": "given_up"}, saved["given_up"])
+        ]
+        yield "sadhak_admission_calls", "gauge", "Backend calls holding or waiting for a slot", [
+            ({"state": "running"}, gate["running"]), ({"state": "waiting"}, gate["waiting"])
+        ]
+        yield "sadhak_admission_refused_total", "counter", "Messages refused by admission control", [
+            ({"reason": "donor_rate"}, gate["donors_refused"]), ({"reason": "queue_full"}, gate["rejected"])
+        ]
+        
+        images = prefetcher.stats()
+        yield "sadhak_image_checks_total", "counter", "Image links probed before sending", [
+            ({"result": "accepted"}, images["accepted"]), ({"result": "rejected"}, images["rejected"])
+        ]
+        
+        thumbs = thumbnails.stats()
+        yield "sadhak_thumbnail_cache_bytes", "gauge", "Thumbnail cache size", [
+            ({"tier": "memory"}, thumbs["memory_bytes"]), ({"tier": "disk"}, thumbs["disk_bytes"])
+        ]
+        
+        policy = resilience.stats()
+        yield "sadhak_retries_total", "counter", "Backend calls retried", [({}, policy["retries"])]
+        yield "sadhak_hedges_total", "counter", "Hedged backend calls", [({}, policy["hedges"])]
+        yield "sadhak_fast_failures_total", "counter", "Calls refused by the open circuit", [({}, policy["fast_failures"])]
+        yield "sadhak_circuit_open", "gauge", "1 while the circuit breaker is open", [({}, int(policy["circuit"] == "open"))]
+        
+        backend_state = warmer.state()
+        yield "sadhak_backend_state", "gauge", "Backend state seen by the warm-up pinger", [
+            ({"state": name}, int(backend_state["state"] == name)) for name in ("warm", "waking", "cold", "down", "unknown")
+        ]
+        if backend_state["last_latency"] is not None:
+            yield "sadhak_backend_ping_seconds", "gauge", "Latency of the last warm-up ping", [({}, backend_state["last_latency"])]
+    
+    registry.add_collector(collect)
+    if METRICS_PORT:
+        registry.serve(METRICS_PORT)
+    if METRICS_FILE:
+        registry.write_periodically(METRICS_FILE)
+    return registry
+
+metrics = get_metrics()
+metrics.sessions.touch(st.session_state.session_id, st.session_state.messages.memory_bytes)
 
 # Sidebar
+rerun.section("sidebar")
 with st.sidebar:
     st.markdown('<div class="info-box">', unsafe_allow_html=True)
     st.markdown("### 🙏 Chat Configuration")
@@ -456,19 +746,80 @@ with st.sidebar:
         st.session_state.mobile_no = mobile_no
         st.session_state.donor_name = donor_name
         st.session_state.ng_code = int(ng_code)
+        if history_db is not None and mobile_no:
+            # Pick up this donor's earlier conversation
+            st.session_state.messages = MessageStore.load(history_db, (mobile_no, int(ng_code)))
+            st.session_state.history_window = HISTORY_PAGE_SIZE
         st.success("Details saved!")
     
     st.markdown('</div>', unsafe_allow_html=True)
     
-    # Fixed Backend API URL (hidden from UI)
-    api_url = "https://chatbot-code-scaz.onrender.com/message"
+    # Render replies token by token as the backend produces them
+    st.toggle("⚡ Stream replies", key="stream_replies", help="Show the reply while AI Sadhak is still typing")
+    st.toggle("♻️ Reuse answers", key="use_response_cache", help="Answer repeated questions from a short-lived cache")
 
     # Stats
     st.markdown('<div class="info-box">', unsafe_allow_html=True)
     st.markdown("### 📊 Chat Statistics")
     st.metric("Total Messages", len(st.session_state.messages))
-    st.metric("Your Messages", len([m for m in st.session_state.messages if m["role"] == "user"]))
-    st.metric("AI Responses", len([m for m in st.session_state.messages if m["role"] == "assistant"]))
+    st.metric("Your Messages", st.session_state.messages.count("user"))
+    st.metric("AI Responses", st.session_state.messages.count("assistant"))
+
+    cache_stats = response_cache.stats()
+    if cache_stats["hits"] or cache_stats["misses"]:
+        st.metric("Cache Hit Rate", f"{cache_stats['hit_rate']:.0%}")
+        st.caption(f"♻️ {cache_stats['hits']} cached answers · {cache_stats['saved_seconds']:.1f}s saved")
+
+    latency_summary = latency_histograms.summary()
+    if latency_summary:
+        with st.expander("⏱️ Client Latency"):
+            st.markdown(
+                "| Phase | p50 | p95 | n |\n|---|---:|---:|---:|\n" + "\n".join(
+                    f"| {phase} | {s['p50'] * 1000:.0f} ms | {s['p95'] * 1000:.0f} ms | {s['count']} |"
+                    for phase, s in latency_summary.items()
+                )
+            )
+    
+    if profiler.enabled:
+        with st.expander("🐢 Rerun Profile"):
+            last_sections = last_run.record["sections"] if last_run is not None and last_run.finished else {}
+            if last_sections:
+                st.caption(
+                    f"Last {last_run.record['kind']} run: {last_run.record['total_ms']:.0f} ms, "
+                    f"{len(last_run.record['messages'])} messages drawn"
+                )
+            st.markdown(
+                "| Section | last | p50 | p95 |\n|---|---:|---:|---:|\n" + "\n".join(
+                    f"| {name} | {last_sections.get(name, 0):.1f} | {s['p50']:.1f} | {s['p95']:.1f} |"
+                    for name, s in profiler.summary().items()
+                )
+            )
+            st.caption(f"Times in ms · trace: {profiler.trace_path}")
+
+    pool_stats = backend.stats()
+    st.caption(
+        f"🔌 Pool: {pool_stats['in_flight']} in flight · "
+        f"{pool_stats['connections_reused']} reused / {pool_stats['connections_opened']} opened"
+    )
+    resilience_stats = resilience.stats()
+    if resilience_stats["circuit"] != "closed" or resilience_stats["retries"]:
+        st.caption(
+            f"🛡️ Circuit {resilience_stats['circuit']} · {resilience_stats['retries']} retries · "
+            f"{resilience_stats['hedges']} hedges"
+        )
+    routing = backend_pool.stats()
+    if len(routing["backends"]) > 1:
+        st.caption("🔀 " + " · ".join(
+            f"{'🟢' if b['healthy'] else '🔴'} {b['name']}"
+            + (f" {b['latency'] * 1000:.0f} ms" if b["latency"] is not None else "")
+            for b in routing["backends"]
+        ))
+    if routing["shadow"] is not None and routing["shadow"]["calls"]:
+        shadow = routing["shadow"]
+        st.caption(
+            f"👥 Shadow: {shadow['latency'] * 1000:.0f} ms vs {shadow['primary_latency'] * 1000:.0f} ms · "
+            f"slower on {shadow['slower']}/{shadow['calls']} calls"
+        )
     
     # Display current configuration
     if st.session_state.mobile_no or st.session_state.donor_name or st.session_state.ng_code:
@@ -485,63 +836,206 @@ with st.sidebar:
     
     # Clear chat
     if st.button("🗑️ Clear Chat", use_container_width=True):
-        st.session_state.messages = []
+        st.session_state.messages.clear()
+        st.session_state.history_window = HISTORY_PAGE_SIZE
+        dispatcher.discard(st.session_state.session_id)
         st.rerun()
 
 # Main chat area
-st.markdown("""
+rerun.section("header")
+BACKEND_STATUS = {
+    "warm": "🟢 Online",
+    "waking": "🟡 Waking up...",
+    "cold": "⚪ Sleeping",
+    "down": "🔴 Unreachable",
+    "unknown": "⚪ Connecting...",
+}
+
+# Header, refreshed every few seconds while the backend is waking up
+@st.fragment(run_every=2 if warmer.state()["state"] in ("waking", "unknown") else None)
+def chat_header():
+    backend_state = warmer.state()
+    status = BACKEND_STATUS[backend_state["state"]]
+    if backend_state["state"] == "warm" and backend_state["last_latency"] is not None:
+        status += f" · {backend_state['last_latency'] * 1000:.0f} ms"
+    
+    st.markdown(f"""
 <div class="chat-header">
     <div class="chat-header-avatar">🙏</div>
     <div class="chat-header-info">
         <h1>Narayan Seva Sansthan</h1>
-        <p>AI Sadhak - Your helpful assistant</p>
+        <p>AI Sadhak - Your helpful assistant · {status}</p>
     </div>
 </div>
 """, unsafe_allow_html=True)
+    
+    # Awake (or given up): full rerun to stop polling
+    if backend_state["state"] not in ("waking", "unknown") and not st.session_state.full_run:
+        st.rerun()
+
+chat_header()
 
 # Display messages
 chat_container = st.container()
-with chat_container:
-    if not st.session_state.messages:
-        st.info("👋 Welcome! Start a conversation by typing a message below.")
-    
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            content = message["content"]
-            timestamp = message.get("timestamp", datetime.now().strftime("%I:%M %p"))
-            has_image = message.get("has_image", False)
-            image_url = message.get("image_url", "")
 
-            if has_image and image_url:
-                st.image(image_url, caption="User Image", width=200)
-            
-            st.markdown(content)
-            st.caption(timestamp)
-
-            if message["role"] == "assistant":
-                classification = message.get("classification", "")
-                sub_classification = message.get("sub_classification", "")
-                confidence = message.get("confidence", "")
-                execution_log = message.get("execution_log", [])
-                
-                if classification:
-                    st.markdown(f'<div style="font-size: 0.85em; color: #555; margin-top: 8px;">📋 <strong>Classification:</strong> {classification}</div>', unsafe_allow_html=True)
-                if sub_classification:
-                    st.markdown(f'<div style="font-size: 0.85em; color: #555; margin-top: 4px;">📌 <strong>Sub-Classification:</strong> {sub_classification}</div>', unsafe_allow_html=True)
-                if confidence:
-                    st.markdown(f'<div style="font-size: 0.85em; color: #555; margin-top: 4px;">✅ <strong>Confidence:</strong> {confidence}</div>', unsafe_allow_html=True)
-
-                if execution_log:
-                    with st.expander("🔍 Execution Log", expanded=False):
-                        for log in execution_log:
-                            st.markdown(
-                                f'<div style="font-size: 0.82em; font-family: monospace; padding: 3px 0; border-bottom: 1px solid #eee;">'
-                                f'<span style="color: #888;">⏱ {log.get("time", "")}</span> &nbsp;|&nbsp; '
-                                f'<span style="color: #333;">{log.get("message", "")}</span>'
-                                f'</div>',
-                                unsafe_allow_html=True
-                            )
+# Render a single history entry
+def render_message(message):
+    with st.chat_message(message.role):
+        if message.has_image:
+            # Never fetches here: the prefetcher makes the thumbnail in the background
+            thumbnail = thumbnails.cached(message.image_url)
+            check = prefetcher.ready(message.image_url)
+            if thumbnail is not None:
+                caption = "User Image"
+                if check is not None and check.oversized and check.width:
+                    caption += f" · downscaled from {check.width}x{check.height}"
+                st.image(thumbnail, caption=caption, width=THUMBNAIL_WIDTH)
+            elif check is None:
+                st.caption("🖼️ Loading image...")
+            elif not check.ok:
+                st.caption(f"⚠️ Image not shown: {check.reason}")
+            else:
+                # Looked fine but couldn't be downscaled: let the browser try the original
+                st.image(message.image_url, caption="User Image", width=THUMBNAIL_WIDTH)
+        
+        # The body as plain markdown: HTML in it is shown, not rendered
+        st.markdown(message.content)
+        # Time and classification, built once when the message arrived
+        st.markdown(st.session_state.messages.render_cache.get(message), unsafe_allow_html=True)
+
+        if message.role == "assistant":
+            execution_log = message.execution_log
+            timings = message.timings
+
+            if execution_log or timings:
+                # Tracks its open state, so a closed log costs one element and no HTML
+                log = st.expander(
+                    f"🔍 Execution Log ({len(execution_log)} steps)" if execution_log else "🔍 Execution Log",
+                    key=f"execution_log_{message.id}",
+                    on_change="rerun"
+                )
+                if log.open:
+                    log.markdown(st.session_state.log_views.get(message), unsafe_allow_html=True)
+
+
+# Build the assistant history entry from a /message result
+def assistant_message(result, timings=()):
+    """Parse ai_response / ai_reason / execution_log into a chat message"""
+    reply = parse_reply(result)
+    return ChatMessage(
+        "assistant",
+        reply["ai_response"],
+        classification=reply["classification"],
+        sub_classification=reply["sub_classification"],
+        confidence="HIGH",
+        execution_log=reply["execution_log"],
+        timings=timings
+    )
+
+# The backend round trip itself, shared by duplicate submits
+def call_backend(job, payload, stream):
+    """One /message call with retries; returns (result, timings dict)"""
+    # Waits here while MAX_CONCURRENT calls are already out (position shown in the chat)
+    with admission.gate.slot(job.id):
+        started = time.monotonic()
+        # Each attempt picks its backend, so a retry or a hedge skips the ones already tried.
+        # Every attempt resends the same payload, so WA_Message_Id stays the same
+        tried = []
+        send = backend.stream if stream else backend.post
+        try:
+            response = resilience.call(
+                lambda seconds: backend_pool.attempt(
+                    payload, lambda api_url: send(api_url, payload, backend.timeout_within(seconds)), tried
+                ),
+                kind="stream" if stream else "post",
+            )
+        except requests.exceptions.Timeout:
+            metrics.inc("sadhak_backend_timeouts_total", "Backend calls that timed out")
+            raise
+        except Exception as e:
+            metrics.inc("sadhak_backend_errors_total", "Failed backend calls", error=type(e).__name__)
+            raise
+        
+        if response.status_code != 200:
+            metrics.inc("sadhak_backend_errors_total", "Failed backend calls", error=f"HTTP {response.status_code}")
+            response.close()
+            raise BackendError(response.status_code)
+        
+        if stream:
+            for token in response:
+                job.append_partial(token)
+            result = response.result
+            timings = dict(response.timings)
+        else:
+            timings = dict(response.timings)
+            parse_started = time.perf_counter()
+            result = backend.decode(response)
+            timings["parse"] = time.perf_counter() - parse_started
+        
+        metrics.inc("sadhak_replies_total", "Replies received from the backend")
+        backend_pool.mirror(payload, time.monotonic() - started)
+        return result, timings
 
+# Runs on the dispatcher's worker pool, so no st.* calls in here
+def fetch_reply(job, payload, stream, use_cache, build_seconds):
+    """Call the backend and return the assistant history entry (None if it went to the outbox)"""
+    use_cache = use_cache and payload["WA_Msg_Type"] == "TEXT"
+    if use_cache:
+        cached = response_cache.get(payload["WA_Msg_Text"], payload["NGCode"], payload["MobileNo"])
+        if cached is not None:
+            return assistant_message(cached)
+    
+    if payload["WA_Msg_Type"] == "IMAGE":
+        # Probing since the message was sent: a bad link is answered here instead of by the backend
+        check = prefetcher.check(payload["WA_Url"], IMAGE_CHECK_WAIT)
+        if check is not None and not check.ok:
+            return ChatMessage("assistant", f"Sorry, I couldn't open that image: {check.reason}. Please check the link and send it again.")
+    
+    if outbox.holds(payload["MobileNo"], payload["NGCode"]):
+        # Earlier messages of this conversation are waiting in the outbox: keep the order
+        outbox.add(job.session_id, payload)
+        return None
+    
+    started = time.monotonic()
+    # A duplicate of a message that is already being answered waits for that call
+    key = message_key(payload["MobileNo"], payload["WA_Msg_Text"] or payload["WA_Url"])
+    try:
+        (result, timings), first = coalescer.run(key, lambda: call_backend(job, payload, stream))
+    except Exception as e:
+        if not can_resend(e):
+            raise
+        # Saved and resent later instead of lost; the reply comes back through dispatcher.deliver()
+        outbox.add(job.session_id, payload, e)
+        return None
+    if not first:
+        # Same answer as the call it joined, whose timings are already recorded
+        return assistant_message(result)
+    
+    timings = dict(timings, build=build_seconds)
+    timings = ordered(timings)
+    latency_histograms.observe_all(timings)
+    
+    if use_cache:
+        response_cache.put(payload["WA_Msg_Text"], payload["NGCode"], payload["MobileNo"], result, time.monotonic() - started)
+    
+    return assistant_message(result, timings)
+
+# History entry for a finished job; failures become an error bubble
+def reply_for(job):
+    if job.error is None:
+        return job.result
+    
+    if isinstance(job.error, BackendError):
+        st.toast(f"❌ API Error: {job.error.status_code}")
+        content = "Sorry, I encountered an error. Please try again."
+    elif isinstance(job.error, Overloaded):
+        st.toast(f"🚦 AI Sadhak is very busy. Please try again in {job.error.retry_after:.0f} seconds.")
+        content = "AI Sadhak is handling a lot of messages right now. Please try again in a minute."
+    else:
+        st.toast(f"❌ Error: {str(job.error)}")
+        content = f"Error: {str(job.error)}"
+    
+    return ChatMessage("assistant", content)
 
 # Function to handle message sending
 def send_message(user_input):
@@ -558,98 +1052,138 @@ def send_message(user_input):
     # Prepare message content
     if is_image_url:
         message_content = "[Image]"
-        message_type = "IMAGE"
         image_url = user_input
     else:
         message_content = user_input
-        message_type = "TEXT"
         image_url = None
     
+    # Same text sent again while its reply is pending (double click, rerun race): keep waiting for it
+    key = message_key(st.session_state.mobile_no, user_input)
+    last_key, last_sent, last_id = st.session_state.get("last_sent", (None, 0.0, None))
+    in_flight = key == last_key and dispatcher.pending(st.session_state.session_id)
+    if in_flight and time.time() - last_sent < DEDUPE_WINDOW:
+        st.toast("⏳ Already sent, waiting for the reply")
+        return
+    # A resubmit of the message still pending keeps its id, so the server can drop the copy
+    still_pending = in_flight or (key == last_key and outbox.waiting(st.session_state.session_id))
+    msg_id = last_id if still_pending else str(uuid.uuid4())
+    
+    wait = admission.donors.take(st.session_state.mobile_no)
+    if wait:
+        st.toast(f"🚦 You're sending messages quickly. Please wait {wait:.0f} seconds.")
+        return
+    st.session_state.last_sent = (key, time.time(), msg_id)
+    
     # Add user message
-    user_message = {
-        "role": "user",
-        "content": message_content if is_image_url else user_input,
-        "timestamp": datetime.now().strftime("%I:%M %p")
-    }
+    st.session_state.messages.append(
+        ChatMessage("user", message_content if is_image_url else user_input, image_url=image_url)
+    )
     
-    if image_url:
-        user_message["image_url"] = image_url
-        user_message["has_image"] = True
+    # Prepare API request
+    build_started = time.perf_counter()
+    payload = build_payload(
+        user_input,
+        st.session_state.mobile_no,
+        st.session_state.donor_name,
+        st.session_state.ng_code,
+        # Retries resend the payload as is, and so this id
+        message_id=msg_id
+    )
+    build_seconds = time.perf_counter() - build_started
     
-    st.session_state.messages.append(user_message)
+    if is_image_url:
+        # Probe the link and make its thumbnail alongside the backend call
+        prefetcher.submit(image_url)
     
-    # Show typing indicator
-    with st.spinner("AI Sadhak is typing..."):
-        try:
-            # Prepare API request
-            payload = {
-                "WA_Auto_Id": 0,
-                "WA_In_Out": "In",
-                "Account_Code": 0,
-                "WA_Received_At": datetime.now().isoformat(),
-                "NGCode": st.session_state.ng_code,
-                "Wa_Name": st.session_state.donor_name,
-                "MobileNo": st.session_state.mobile_no,
-                "WA_Msg_To": st.session_state.mobile_no,
-                "WA_Msg_Text": user_input if not is_image_url else "",
-                "WA_Msg_Type": message_type,
-                "Integration_Type": "streamlit",
-                "WA_Message_Id": str(uuid.uuid4()),
-                "WA_Url": image_url if is_image_url else "",
-                "Status": "success",
-                "Donor_Name": st.session_state.donor_name
-            }
-            
-            # Make API call
-            response = requests.post(api_url, json=payload, timeout=90)
-            
-            if response.status_code == 200:
-                result = response.json()
-                
-                # Parse classification
-                ai_reason = result.get("ai_reason", "")
-                classification_parts = ai_reason.split("|")
-                main_class = classification_parts[0] if len(classification_parts) > 0 else ""
-                sub_class = classification_parts[1] if len(classification_parts) > 1 else ""
-                
-                # Add bot response
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": result.get("ai_response", "Sorry, I couldn't process your request."),
-                    "timestamp": datetime.now().strftime("%I:%M %p"),
-                    "classification": main_class,
-                    "sub_classification": sub_class,
-                    "confidence": "HIGH",
-                    "execution_log": result.get("execution_log", [])
-                })
-            else:
-                st.error(f"❌ API Error: {response.status_code}")
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": "Sorry, I encountered an error. Please try again.",
-                    "timestamp": datetime.now().strftime("%I:%M %p")
-                })
-        
-        except requests.exceptions.Timeout:
-            st.error("⏱️ Request timed out. Please try again.")
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": "Request timed out. Please try again.",
-                "timestamp": datetime.now().strftime("%I:%M %p")
-            })
-        except Exception as e:
-            st.error(f"❌ Error: {str(e)}")
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": f"Error: {str(e)}",
-                "timestamp": datetime.now().strftime("%I:%M %p")
-            })
+    # Hand the API call to the worker pool; the reply is picked up by chat_area()
+    dispatcher.submit(
+        st.session_state.session_id, fetch_reply, payload,
+        st.session_state.stream_replies, st.session_state.use_response_cache, build_seconds
+    )
     
     # Increment counter to force input clear
     st.session_state.input_counter += 1
     st.rerun()
 
+def show_older_messages():
+    st.session_state.history_window += HISTORY_PAGE_SIZE
+
+# Chat area: reruns on its own (polling the worker pool while replies are
+# outstanding) without re-executing the CSS, sidebar and form sections
+@st.fragment(
+    run_every=0.5 if dispatcher.pending(st.session_state.session_id)
+    else 2 if outbox.waiting(st.session_state.session_id) else None
+)
+def chat_area():
+    if st.session_state.full_run:
+        run = rerun
+    else:
+        run = profiler.start("fragment", st.session_state.get("profile_run"))
+        st.session_state.profile_run = run
+        run.section("chat")
+    
+    finished = dispatcher.collect(st.session_state.session_id)
+    for job in finished:
+        reply = reply_for(job)
+        if reply is None:
+            st.toast("📮 AI Sadhak can't be reached right now. Your message is saved and will be sent automatically.")
+        else:
+            st.session_state.messages.append(reply)
+    
+    messages = st.session_state.messages
+    pending = dispatcher.pending(st.session_state.session_id)
+    
+    if not messages and not pending:
+        st.info("👋 Welcome! Start a conversation by typing a message below.")
+    
+    hidden = len(messages) - st.session_state.history_window
+    if hidden > 0:
+        st.button(
+            f"⬆️ Show {min(hidden, HISTORY_PAGE_SIZE)} older messages ({hidden} hidden)",
+            key="show_older",
+            on_click=show_older_messages,
+            use_container_width=True
+        )
+    
+    for message in messages.tail(st.session_state.history_window):
+        render_started = time.perf_counter()
+        render_message(message)
+        render_seconds = time.perf_counter() - render_started
+        run.message(message.id, render_seconds)
+        if message.timings and message.timings[-1][0] != "render":
+            # First time this reply is drawn: time it as the last phase
+            message.timings += (("render", render_seconds),)
+            latency_histograms.observe("render", render_seconds)
+    
+    for job in pending:
+        with st.chat_message("assistant"):
+            queued = admission.gate.position(job.id)
+            if job.partial:
+                st.markdown(job.partial + " ▌")
+            elif queued:
+                position, eta = queued
+                st.caption(f"⏳ Waiting for AI Sadhak: #{position} in queue, about {max(eta, 1):.0f} s")
+            else:
+                st.caption("AI Sadhak is typing...")
+    
+    saved = outbox.waiting(st.session_state.session_id)
+    if saved:
+        st.caption(f"📮 {saved} message{'s' if saved > 1 else ''} saved, will be sent when AI Sadhak is back")
+    
+    if not st.session_state.full_run:
+        run.finish(session=st.session_state.session_id, history=len(messages))
+    
+    # Last reply is in: full rerun to stop polling and refresh the sidebar stats.
+    # Not during a full run, where st.rerun() would drop a pending form submit.
+    if finished and not pending and not st.session_state.full_run:
+        st.rerun()
+
+rerun.section("chat")
+with chat_container:
+    chat_area()
+
 # Input area
+rerun.section("form")
 st.markdown("---")
 
 # Create a form to enable Enter key submission
@@ -672,6 +1206,7 @@ with st.form(key="message_form", clear_on_submit=True):
         send_message(user_input)
 
 # Footer
+rerun.section("footer")
 st.markdown("---")
 st.markdown("""
 <div style='text-align: center; color: #666; font-size: 12px; padding: 20px;'>
@@ -680,3 +1215,6 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+rerun.finish(session=st.session_state.session_id, history=len(st.session_state.messages))
+st.session_state.full_run = False
+
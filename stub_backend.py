@@ -0,0 +1,304 @@
+"""Local stand-in for the /message backend, for offline and CI performance work.
+
+Accepts the same payload as send_message and answers with ai_response,
+ai_reason ("main|sub") and execution_log, like the real service. Latency,
+cold starts, errors and streaming are configurable, and runs are
+reproducible with --seed.
+
+    python stub_backend.py --port 8000 --latency lognormal --median 1.2 --sigma 0.4
+    python stub_backend.py --cold-start 20 --idle-timeout 300 --error-rate 0.02
+    SADHAK_API_URL=http://127.0.0.1:8000/message streamlit run streamlit_code.py
+
+Endpoints: POST /message, POST /message/stream (SSE) and GET / (health).
+
+Speaks the negotiated wire format of wire.py: request bodies may be gzip /
+zstd compressed and JSON or msgpack, answers follow the client's Accept and
+Accept-Encoding. --plain-wire turns that off, like a backend that only
+knows JSON.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import wire
+
+REQUIRED_FIELDS = ("MobileNo", "WA_Msg_Type", "WA_Message_Id")
+
+# keyword -> (ai_reason, answer); first match wins
+ANSWERS = [
+    ("80g", "Donation|80G Certificate",
+     "Your 80G certificate is emailed within 7 days of the donation. "
+     "You can also download it from the donor portal using your NG Code."),
+    ("receipt", "Donation|Receipt",
+     "Receipts are sent by email and WhatsApp right after the donation is confirmed. "
+     "Please share your NG Code if you would like us to resend it."),
+    ("status", "Donation|Status",
+     "Your donation has been received and is being processed. Thank you for your support!"),
+    ("donat", "Donation|General",
+     "Thank you for your interest in donating to Narayan Seva Sansthan. "
+     "You can donate online, by bank transfer or at any of our centres."),
+    ("surgery", "Service|Surgery",
+     "Narayan Seva Sansthan provides free corrective surgeries for people with disabilities. "
+     "Our team will contact you with the details."),
+]
+DEFAULT_ANSWER = ("General|Query", "Jai Narayan! How can AI Sadhak help you today?")
+IMAGE_ANSWER = ("Media|Image", "Thank you for sharing the image. Our team will review it shortly.")
+
+
+class StubConfig:
+    """Behaviour knobs of the stub backend"""
+
+    def __init__(self, latency="lognormal", median=0.8, sigma=0.5, low=0.2, high=2.0,
+                 cold_start=0.0, idle_timeout=900.0, error_rate=0.0, error_status=503,
+                 hang_rate=0.0, hang_seconds=120.0, token_delay=0.03, seed=None, dedupe=True,
+                 plain_wire=False):
+        self.latency = latency
+        self.median = median
+        self.sigma = sigma
+        self.low = low
+        self.high = high
+        self.cold_start = cold_start
+        self.idle_timeout = idle_timeout
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.token_delay = token_delay
+        self.dedupe = dedupe
+        self.plain_wire = plain_wire
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._last_request = None
+        self._replies = OrderedDict()
+
+    def sample_latency(self):
+        with self._lock:
+            if self.latency == "fixed":
+                return self.median
+            if self.latency == "uniform":
+                return self.random.uniform(self.low, self.high)
+            return self.random.lognormvariate(0, self.sigma) * self.median
+
+    def roll(self, rate):
+        with self._lock:
+            return self.random.random() < rate
+
+    def cold_delay(self):
+        """Cold start cost of this request: the instance sleeps after idle_timeout"""
+        with self._lock:
+            now = time.monotonic()
+            cold = self._last_request is None or now - self._last_request > self.idle_timeout
+            self._last_request = now
+        return self.cold_start if cold else 0.0
+
+    def remembered(self, message_id):
+        with self._lock:
+            return self._replies.get(message_id)
+
+    def remember(self, message_id, reply):
+        with self._lock:
+            self._replies[message_id] = reply
+            while len(self._replies) > 10000:
+                self._replies.popitem(last=False)
+
+
+def make_reply(payload, elapsed):
+    """ai_response / ai_reason / execution_log for a payload"""
+    if payload.get("WA_Msg_Type") == "IMAGE" or payload.get("WA_Url"):
+        ai_reason, answer = IMAGE_ANSWER
+    else:
+        text = (payload.get("WA_Msg_Text") or "").lower()
+        ai_reason, answer = next(((reason, ans) for key, reason, ans in ANSWERS if key in text), DEFAULT_ANSWER)
+
+    started = datetime.now().timestamp() - elapsed
+    steps = [
+        (0.0, "Received message"),
+        (0.05, f"Donor lookup NGCode={payload.get('NGCode', 0)}"),
+        (0.15, f"Classified as {ai_reason}"),
+        (0.9, "Generated response"),
+        (1.0, "Done"),
+    ]
+    execution_log = [
+        {"time": datetime.fromtimestamp(started + elapsed * fraction).strftime("%H:%M:%S.%f")[:-3], "message": message}
+        for fraction, message in steps
+    ]
+    return {"ai_response": answer, "ai_reason": ai_reason, "execution_log": execution_log}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Buffer writes so headers and body leave in one segment
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+    config = StubConfig()
+    quiet = True
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/health"):
+            return self._send_json(404, {"detail": "Not Found"})
+        time.sleep(self.config.cold_delay())
+        self._send_json(200, {"status": "ok"})
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path not in ("/message", "/message/stream"):
+            return self._send_json(404, {"detail": "Not Found"})
+
+        content_type = self.headers.get("Content-Type", "")
+        encoding = self.headers.get("Content-Encoding", "identity").strip().lower()
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if self.config.plain_wire and (encoding != "identity" or wire.MSGPACK_TYPE in content_type):
+            return self._send_json(415, {"detail": "Send plain JSON"})
+        if encoding not in wire.ENCODINGS + ("identity",) or (wire.MSGPACK_TYPE in content_type and wire.msgpack is None):
+            return self._send_json(415, {"detail": f"Unsupported body: {content_type}, {encoding}"})
+        try:
+            payload = wire.decode(wire.decompress(body, encoding), content_type) if body else {}
+        except (ValueError, OSError, EOFError):
+            return self._send_json(400, {"detail": "Invalid body"})
+        missing = [field for field in REQUIRED_FIELDS if not payload.get(field)]
+        if missing:
+            return self._send_json(422, {"detail": f"Missing fields: {', '.join(missing)}"})
+
+        config = self.config
+        delay = config.cold_delay()
+        if config.roll(config.hang_rate):
+            time.sleep(config.hang_seconds)
+        if config.roll(config.error_rate):
+            time.sleep(delay)
+            return self._send_json(config.error_status, {"detail": "Injected error"})
+
+        # Retries of the same WA_Message_Id get the same answer without new work
+        reply = config.remembered(payload["WA_Message_Id"]) if config.dedupe else None
+        if reply is None:
+            latency = config.sample_latency()
+            reply = make_reply(payload, latency)
+            if config.dedupe:
+                config.remember(payload["WA_Message_Id"], reply)
+        else:
+            latency = 0.0
+
+        if path == "/message/stream":
+            return self._stream(reply, delay, latency)
+        time.sleep(delay + latency)
+        self._send_json(200, reply)
+
+    def _stream(self, reply, delay, latency):
+        words = reply["ai_response"].split(" ")
+        # Time to first token: the cold start plus the part of the latency spent before generating
+        time.sleep(delay + max(latency - self.config.token_delay * len(words), 0))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self._advertise()
+        self.end_headers()
+        for i, word in enumerate(words):
+            token = word if i == 0 else " " + word
+            self._chunk(f"data: {json.dumps({'token': token})}\n\n")
+            time.sleep(self.config.token_delay)
+        final = {"ai_reason": reply["ai_reason"], "execution_log": reply["execution_log"]}
+        self._chunk(f"event: done\ndata: {json.dumps(final)}\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_json(self, status, body):
+        """Send body in the format and encoding the client asked for (plain JSON with --plain-wire)"""
+        content_type, encoding = wire.JSON_TYPE, None
+        if not self.config.plain_wire:
+            types = (wire.MSGPACK_TYPE, wire.JSON_TYPE) if wire.msgpack is not None else (wire.JSON_TYPE,)
+            # */* (curl, browsers) gets JSON: only an explicit msgpack is answered in msgpack
+            content_type = (wire.accepted(self.headers.get("Accept"), types) or [wire.JSON_TYPE])[0]
+            encodings = wire.accepted(self.headers.get("Accept-Encoding"), wire.ENCODINGS)
+            encoding = encodings[0] if encodings else None
+        data = wire.encode(body, content_type)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if encoding is not None and len(data) >= wire.MIN_COMPRESS_BYTES:
+            data = wire.compress(data, encoding)
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self._advertise()
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _advertise(self):
+        # Request body encodings the stub reads (RFC 7694)
+        if not self.config.plain_wire:
+            self.send_header("Accept-Encoding", ", ".join(wire.ENCODINGS))
+
+
+class StubServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 resets connections when a load test opens many at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def make_server(config=None, host="127.0.0.1", port=8000, quiet=True):
+    """Build a stub server (port 0 picks a free port); call serve_forever() to run it"""
+    handler = type("Handler", (StubHandler,), {"config": config or StubConfig(), "quiet": quiet})
+    return StubServer((host, port), handler)
+
+
+def start_in_thread(config=None, host="127.0.0.1", port=0):
+    """Run a stub server in a daemon thread; returns (server, /message URL)"""
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, name="stub-backend", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/message"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the /message backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", choices=("fixed", "uniform", "lognormal"), default="lognormal",
+                        help="reply latency distribution (default: lognormal)")
+    parser.add_argument("--median", type=float, default=0.8, help="fixed / median latency in seconds")
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal shape")
+    parser.add_argument("--low", type=float, default=0.2, help="uniform lower bound in seconds")
+    parser.add_argument("--high", type=float, default=2.0, help="uniform upper bound in seconds")
+    parser.add_argument("--cold-start", type=float, default=0.0, help="extra delay after an idle period")
+    parser.add_argument("--idle-timeout", type=float, default=900.0, help="idle seconds before going cold")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="status of injected errors")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="fraction of requests that hang")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    parser.add_argument("--token-delay", type=float, default=0.03, help="seconds between streamed tokens")
+    parser.add_argument("--seed", type=int, help="random seed for reproducible runs")
+    parser.add_argument("--no-dedupe", action="store_true", help="treat repeated WA_Message_Id as new messages")
+    parser.add_argument("--plain-wire", action="store_true", help="only accept and send uncompressed JSON")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency, median=args.median, sigma=args.sigma, low=args.low, high=args.high,
+        cold_start=args.cold_start, idle_timeout=args.idle_timeout,
+        error_rate=args.error_rate, error_status=args.error_status,
+        hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+        token_delay=args.token_delay, seed=args.seed, dedupe=not args.no_dedupe,
+        plain_wire=args.plain_wire,
+    )
+    server = make_server(config, args.host, args.port, quiet=not args.verbose)
+    print(f"Stub backend on http://{args.host}:{server.server_address[1]}/message")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
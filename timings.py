@@ -0,0 +1,91 @@
+"""Client-side latency breakdown of /message calls.
+
+Each assistant reply carries the time spent in every phase of its call:
+
+    build     building the payload
+    dns       resolving the backend host      (new connections only)
+    connect   TCP connect                     (new connections only)
+    tls       TLS handshake                   (new connections only)
+    wait      request sent -> first byte of the answer (backend time)
+    download  first byte -> last byte
+    parse     decoding the JSON body
+    render    drawing the message in Streamlit
+
+RollingHistograms aggregates the recent samples of every phase across all
+sessions, and also keeps cumulative bucket counts for the metrics export.
+"""
+import bisect
+import math
+import threading
+from collections import deque
+
+PHASES = ("build", "dns", "connect", "tls", "wait", "download", "parse", "render")
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+WINDOW = 500
+
+
+def ordered(timings):
+    """(phase, seconds) pairs in PHASES order, skipping phases that didn't happen"""
+    return tuple((phase, timings[phase]) for phase in PHASES if phase in timings)
+
+
+def parse_clock(value):
+    """Seconds since midnight of a backend log time such as '14:03:22.418'"""
+    try:
+        hours, minutes, seconds = value.strip().split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (AttributeError, ValueError):
+        return None
+
+
+class RollingHistograms:
+    """Latency histograms over the last WINDOW samples of each phase"""
+
+    def __init__(self, window=WINDOW, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._samples = {phase: deque(maxlen=window) for phase in PHASES}
+        # phase -> [per-bucket counts, sum, count] since the process started
+        self._totals = {}
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            self._samples.setdefault(phase, deque(maxlen=WINDOW)).append(seconds)
+            totals = self._totals.setdefault(phase, [[0] * len(self.buckets), 0.0, 0])
+            totals[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            totals[1] += seconds
+            totals[2] += 1
+
+    def observe_all(self, timings):
+        for phase, seconds in timings:
+            self.observe(phase, seconds)
+
+    def cumulative(self):
+        """{phase: (cumulative (upper bound, count) pairs, sum, count)} since start"""
+        with self._lock:
+            totals = {phase: (list(counts), total, n) for phase, (counts, total, n) in self._totals.items()}
+        result = {}
+        for phase, (counts, total, n) in totals.items():
+            running = 0
+            buckets = []
+            for bound, count in zip(self.buckets, counts):
+                running += count
+                buckets.append((bound, running))
+            result[phase] = (buckets, total, n)
+        return result
+
+    def summary(self):
+        """{phase: {"count", "p50", "p95"}} for phases with samples"""
+        with self._lock:
+            snapshot = {phase: sorted(samples) for phase, samples in self._samples.items() if samples}
+        return {
+            phase: {
+                "count": len(samples),
+                "p50": samples[min(int(0.50 * len(samples)), len(samples) - 1)],
+                "p95": samples[min(int(0.95 * len(samples)), len(samples) - 1)],
+            }
+            for phase, samples in snapshot.items()
+        }
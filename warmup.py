@@ -0,0 +1,139 @@
+"""Keeps the /message backend warm.
+
+The backend runs on an instance that sleeps when idle, so the first request
+after a quiet spell pays a long cold start. BackendWarmer pings it when the
+app starts and when a session opens, and then on a fixed schedule for as long
+as sessions are active. The ping goes through the shared BackendClient, so it
+also keeps a pooled connection open.
+
+Given a BackendPool, it pings every backend of the pool instead (which also
+updates their health), and reports the backend as warm while any answers.
+
+Each backend is pinged at the root of its host, or at SADHAK_WARMUP_URL: a
+path there (/health) is taken on every backend's host, a full URL is
+pinged as is.
+"""
+import os
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+# Seconds between pings while sessions are active
+PING_INTERVAL = float(os.environ.get("SADHAK_WARMUP_INTERVAL", 300))
+
+# Stop pinging when no session has been active for this long
+ACTIVE_WINDOW = 30 * 60
+
+# The backend host goes to sleep after this much idle time
+SLEEP_AFTER = 15 * 60
+
+# A ping slower than this means the backend was asleep
+COLD_THRESHOLD = 5.0
+
+PING_TIMEOUT = (5, 90)
+
+PING_URL = os.environ.get("SADHAK_WARMUP_URL", "")
+
+
+def ping_url_for(api_url, ping_url=PING_URL):
+    """Ping target of a backend: ping_url on its host, or the root of the host"""
+    parts = urlsplit(api_url)
+    return urljoin(f"{parts.scheme}://{parts.netloc}/", ping_url)
+
+
+class BackendWarmer:
+    """Background pinger that tracks whether the backend is cold or warm"""
+
+    def __init__(self, client, api_url, ping_url=None, interval=PING_INTERVAL, pool=None):
+        self.client = client
+        self.ping_url = ping_url or ping_url_for(api_url)
+        self.interval = interval
+        self.pool = pool
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pinging = False
+        self._last_active = time.time()
+        self._last_ok = None
+        self._last_latency = None
+        self._last_error = None
+        self._was_cold = False
+
+        self._thread = threading.Thread(target=self._run, name="sadhak-warmup", daemon=True)
+        self._thread.start()
+
+    def touch(self):
+        """Record session activity (keeps the schedule running)"""
+        self._last_active = time.time()
+
+    def session_opened(self):
+        """Ping right away unless the backend answered recently"""
+        self.touch()
+        with self._lock:
+            recent = self._last_ok is not None and time.time() - self._last_ok < self.interval / 2
+        if not recent:
+            self._wake.set()
+
+    def state(self):
+        """'warm', 'waking', 'cold', 'down' or 'unknown', plus the last ping latency"""
+        with self._lock:
+            now = time.time()
+            if self._pinging and (self._last_ok is None or now - self._last_ok > SLEEP_AFTER):
+                state = "waking"
+            elif self._last_ok is not None and now - self._last_ok < SLEEP_AFTER:
+                state = "warm"
+            elif self._last_error is not None:
+                state = "down"
+            elif self._last_ok is not None:
+                state = "cold"
+            else:
+                state = "unknown"
+            return {
+                "state": state,
+                "last_latency": self._last_latency,
+                "last_ok": self._last_ok,
+                "last_error": self._last_error,
+                "was_cold": self._was_cold,
+            }
+
+    def ping(self):
+        """Ping the backend once; any HTTP answer means it is awake"""
+        with self._lock:
+            self._pinging = True
+        started = time.monotonic()
+        error = None
+        if self.pool is not None:
+            # In parallel, so the latency is the slowest backend's: the one still waking up
+            if not self.pool.check():
+                error = "; ".join(
+                    f"{b['name']}: {b['last_error']}" for b in self.pool.stats()["backends"] if b["last_error"]
+                )
+        else:
+            try:
+                self.client.session.get(self.ping_url, timeout=PING_TIMEOUT).close()
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+        if error is not None:
+            with self._lock:
+                self._last_error = error
+                self._pinging = False
+            return False
+        latency = time.monotonic() - started
+        with self._lock:
+            self._last_ok = time.time()
+            self._last_latency = latency
+            self._last_error = None
+            self._was_cold = latency > COLD_THRESHOLD
+            self._pinging = False
+        return True
+
+    def _run(self):
+        # Warm up as soon as the app starts
+        self.ping()
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if time.time() - self._last_active < ACTIVE_WINDOW:
+                self.ping()
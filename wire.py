@@ -0,0 +1,182 @@
+"""Wire format of /message calls.
+
+Payloads and replies are JSON. Three optional libraries make them smaller,
+or faster to encode and decode, when they are installed:
+
+- orjson replaces the json module for encoding and decoding
+- msgpack sends bodies as application/msgpack instead of JSON
+- zstd (the compression.zstd module of Python 3.14, or backports.zstd)
+  is preferred over gzip
+
+Both sides negotiate, so either one can run without any of them. Every
+request says what the client can read (Accept, Accept-Encoding), and the
+server answers in one of those formats. Request bodies start out as plain
+JSON. What a host accepts is learned from its answers. It lists the
+encodings it accepts for request bodies in Accept-Encoding (RFC 7694). A
+host that answers in msgpack also reads msgpack. A 415 answer resets that
+host to plain JSON.
+
+SSE streams stay uncompressed JSON text, so tokens are not held back in a
+compressor's buffer.
+
+    SADHAK_WIRE=json    plain, uncompressed JSON only (default: auto)
+"""
+import gzip
+import json
+import os
+import threading
+from urllib.parse import urlsplit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        from backports import zstd
+    except ImportError:
+        zstd = None
+
+WIRE_MODE = os.environ.get("SADHAK_WIRE", "auto")
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+
+# Best first; urllib3 and aiohttp decode zstd answers with the same module
+ENCODINGS = ("zstd", "gzip") if zstd is not None else ("gzip",)
+
+# Smaller bodies are sent as they are: the framing would eat the gain
+MIN_COMPRESS_BYTES = 256
+
+
+def dumps(obj):
+    """JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode(obj, content_type=JSON_TYPE):
+    if content_type == MSGPACK_TYPE:
+        return msgpack.packb(obj, use_bin_type=True)
+    return dumps(obj)
+
+
+def decode(data, content_type=""):
+    """A body in either format, by its Content-Type"""
+    if MSGPACK_TYPE in (content_type or "") and msgpack is not None:
+        return msgpack.unpackb(data, raw=False)
+    return loads(data)
+
+
+def compress(data, encoding):
+    if encoding == "zstd":
+        return zstd.compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    return data
+
+
+def decompress(data, encoding):
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "zstd" and zstd is not None:
+        return zstd.decompress(data)
+    if encoding in ("gzip", "x-gzip"):
+        return gzip.decompress(data)
+    if encoding == "identity":
+        return data
+    raise ValueError(f"unsupported content encoding: {encoding}")
+
+
+def accepted(header, supported):
+    """The entries of supported that a header such as "gzip;q=0.5, zstd" allows, in supported's order"""
+    allowed = set()
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if name and params not in ("q=0", "q=0.0"):
+            allowed.add(name.strip().lower())
+    return [value for value in supported if value in allowed or "*" in allowed]
+
+
+class WireFormat:
+    """Encodes request bodies the way each backend host reads them"""
+
+    def __init__(self, mode=WIRE_MODE):
+        self.compact = mode != "json"
+        self._lock = threading.Lock()
+        # host -> (content type, encoding or None) of request bodies
+        self._hosts = {}
+        self._bytes_raw = 0
+        self._bytes_sent = 0
+
+    def accept_headers(self):
+        """What the client reads"""
+        if not self.compact:
+            return {"Accept": JSON_TYPE, "Accept-Encoding": "identity"}
+        accept = f"{MSGPACK_TYPE}, {JSON_TYPE};q=0.9" if msgpack is not None else JSON_TYPE
+        return {"Accept": accept, "Accept-Encoding": ", ".join(ENCODINGS)}
+
+    def request(self, url, payload):
+        """(body bytes, headers) for a request to url"""
+        with self._lock:
+            content_type, encoding = self._hosts.get(urlsplit(url).netloc, (JSON_TYPE, None))
+        headers = self.accept_headers()
+        headers["Content-Type"] = content_type
+        body = encode(payload, content_type)
+        raw = len(body)
+        if encoding is not None and raw >= MIN_COMPRESS_BYTES:
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+        with self._lock:
+            self._bytes_raw += raw
+            self._bytes_sent += len(body)
+        return body, headers
+
+    def learn(self, url, status, headers):
+        """Take note of what an answer from url says about its host
+
+        Returns True when the host refused the body format (415) and was
+        reset to plain JSON, so the request is worth sending again.
+        """
+        if not self.compact:
+            return False
+        host = urlsplit(url).netloc
+        with self._lock:
+            current = self._hosts.get(host, (JSON_TYPE, None))
+            if status == 415:
+                self._hosts.pop(host, None)
+                return current != (JSON_TYPE, None)
+            if not 200 <= status < 300:
+                return False
+            response_type = headers.get("Content-Type", "")
+            content_type = current[0]
+            if MSGPACK_TYPE in response_type and msgpack is not None:
+                content_type = MSGPACK_TYPE
+            elif JSON_TYPE in response_type:
+                content_type = JSON_TYPE
+            encodings = accepted(headers.get("Accept-Encoding"), ENCODINGS)
+            self._hosts[host] = (content_type, encodings[0] if encodings else None)
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bytes_raw": self._bytes_raw,
+                "bytes_sent": self._bytes_sent,
+                "hosts": {host: {"content_type": t, "encoding": e} for host, (t, e) in self._hosts.items()},
+            }